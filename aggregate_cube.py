@@ -0,0 +1,258 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+from keyword_matcher import KeywordMatcher
+from instrumentation import log
+
+"""
+- aggregate cube of the clean data: one row per (subreddit, category, day) with
+    - posts: number of submissions/comments
+    - score_*: histogram of the scores (SCORE_EDGES)
+    - keyword_*: number of posts with at least one keyword of a category (only if keyword categories are given, see keyword_matcher.py)
+    - a HyperLogLog sketch of the authors (registers in a separate .npy file), so unique authors can be estimated for any period
+- weekly, monthly and period values are computed by rolling up the cube (rollup, count_over_time, period_average) instead of grouping the
+  post-level csv files again, the cube has a few thousand rows
+- preprocessing_BERTopic.py writes the cube next to the clean csv files ("aggregate cube" folder), with the keyword categories of
+  keywords_broader_groups.json (the keywords_broader_groups of posts_traditional_roles.ipynb). A cube can also be built from a clean csv file:
+    e.g. python aggregate_cube.py --csv mommit_clean.csv --keywords keywords_broader_groups.json --output "aggregate cube/mommit"
+"""
+
+CUBE_FOLDER = "aggregate cube"
+# keyword categories of the cube {category: list of keywords}, next to the scripts (they are run from the data folder)
+KEYWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keywords_broader_groups.json")
+CUBE_KEYS = ["subreddit", "category", "day"]
+# 2**HLL_PRECISION registers per sketch, standard error about 1.04 / sqrt(2**HLL_PRECISION) (2.3 %)
+HLL_PRECISION = 11
+HLL_REGISTERS = 2**HLL_PRECISION
+# lower edges of the score bins, scores below the first edge get their own bin
+SCORE_EDGES = [0, 1, 2, 5, 10, 20, 50, 100, 500, 1000]
+SCORE_COLUMNS = ["score_lt_0"] + [f"score_{low}_{high}" for low, high in zip(SCORE_EDGES[:-1], SCORE_EDGES[1:])] + [f"score_ge_{SCORE_EDGES[-1]}"]
+
+
+def load_keywords(path=KEYWORDS_FILE):
+    """
+    keyword categories from a json file {category: list of keywords}, None if path is None or the file does not exist (the cube has no
+    keyword columns then)
+    """
+    if path is None:
+        return None
+    if not os.path.exists(path):
+        log.warning(f"{path} not found, the aggregate cube has no keyword hit counts")
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def keyword_column(category:str):
+    """
+    cube column of a keyword category, named like the label columns of label_to_chores (e.g. keyword_household_chores)
+    """
+    return "keyword_" + category.lower().replace(" ", "_")
+
+
+def hll_registers(values):
+    """
+    register and rank of each value for a HyperLogLog sketch: the first HLL_PRECISION bits of a 64 bit hash choose the register, the rank is
+    the position of the first 1 bit in the next 32 bits
+    """
+    hashes = pd.util.hash_pandas_object(pd.Series(values, dtype=object).astype(str), index=False).to_numpy()
+    registers = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    rest = ((hashes >> np.uint64(32 - HLL_PRECISION)) & np.uint64(2**32 - 1)).astype(np.float64)
+    ranks = np.where(rest > 0, 32 - np.floor(np.log2(np.maximum(rest, 1))), 33).astype(np.uint8)
+    return registers, ranks
+
+
+def hll_estimate(registers:np.ndarray):
+    """
+    estimated number of different values of each sketch (rows of registers), with the linear counting correction for small numbers
+    """
+    registers = np.atleast_2d(registers).astype(np.float64)
+    alpha = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+    raw = alpha * HLL_REGISTERS**2 / np.sum(2.0 ** -registers, axis=1)
+    zeros = np.sum(registers == 0, axis=1)
+    small = (raw <= 2.5 * HLL_REGISTERS) & (zeros > 0)
+    linear = HLL_REGISTERS * np.log(HLL_REGISTERS / np.maximum(zeros, 1))
+    return np.where(small, linear, raw)
+
+
+def merge_sketches(groups:np.ndarray, registers:np.ndarray, n_groups:int):
+    """
+    merges the sketches (rows of registers) of each group: the maximum of every register
+    """
+    merged = np.zeros((n_groups, registers.shape[1]), dtype=np.uint8)
+    if len(groups):
+        order = np.argsort(groups, kind="mergesort")
+        starts = np.flatnonzero(np.r_[True, groups[order][1:] != groups[order][:-1]])
+        merged[groups[order][starts]] = np.maximum.reduceat(registers[order], starts, axis=0)
+    return merged
+
+
+class AggregateCube:
+    """
+    This class holds the aggregate cube of one or more clean dataframes.
+    Args:
+        keywords: dictionary {category: list of keywords} for the keyword hit counts (matched on the lower case whole_text), None for none
+    """
+
+    def __init__(self, keywords=None):
+        self.matcher = KeywordMatcher(keywords) if keywords else None
+        keyword_columns = [keyword_column(category) for category in self.matcher.categories] if self.matcher is not None else []
+        self.count_columns = ["posts"] + SCORE_COLUMNS + keyword_columns
+        self.counts = pd.DataFrame(columns=CUBE_KEYS + self.count_columns)
+        self.sketches = np.zeros((0, HLL_REGISTERS), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, df:pd.DataFrame):
+        """
+        adds the rows of a clean dataframe (e.g. one chunk of clean_csv) to the cube
+        """
+        if self.matcher is None and len(self.count_columns) > 1 + len(SCORE_COLUMNS):
+            raise ValueError("The cube has keyword columns, load it with its keyword categories to add rows")
+        if len(df) == 0:
+            return
+        keys = pd.DataFrame({
+            "subreddit": df["subreddit"].astype(str).to_numpy(),
+            "category": df["category"].astype(str).to_numpy(),
+            "day": pd.to_datetime(df["date_time"]).dt.floor("D").to_numpy(),
+        })
+        groups = keys.groupby(CUBE_KEYS, sort=True).ngroup().to_numpy()
+        n_groups = groups.max() + 1
+
+        counts = np.zeros((n_groups, len(self.count_columns)), dtype=np.int64)
+        counts[:, 0] = np.bincount(groups, minlength=n_groups)
+        score = pd.to_numeric(df["score"], errors="coerce").to_numpy(dtype=np.float64)
+        has_score = ~np.isnan(score)
+        bins = np.searchsorted(SCORE_EDGES, score[has_score], side="right")
+        np.add.at(counts, (groups[has_score], 1 + bins), 1)
+        if self.matcher is not None:
+            hits = self.matcher.category_counts(self.matcher.hit_matrix(df["whole_text"].astype(str).str.lower())) > 0
+            for i in range(hits.shape[1]):
+                counts[:, 1 + len(SCORE_COLUMNS) + i] = np.bincount(groups, weights=hits[:, i], minlength=n_groups)
+
+        sketches = np.zeros((n_groups, HLL_REGISTERS), dtype=np.uint8)
+        registers, ranks = hll_registers(df["author"].to_numpy())
+        np.maximum.at(sketches, (groups, registers), ranks)
+
+        chunk = keys.drop_duplicates().sort_values(CUBE_KEYS).reset_index(drop=True)
+        chunk[self.count_columns] = counts
+        self.merge(chunk, sketches)
+
+    def merge(self, counts:pd.DataFrame, sketches:np.ndarray):
+        """
+        merges cube rows into the cube: counts of the same (subreddit, category, day) are summed, sketches are merged
+        """
+        all_counts = pd.concat([self.counts, counts], ignore_index=True)
+        all_counts["day"] = pd.to_datetime(all_counts["day"])
+        groups = all_counts.groupby(CUBE_KEYS, sort=True).ngroup().to_numpy()
+        self.sketches = merge_sketches(groups, np.concatenate([self.sketches, sketches]), groups.max() + 1)
+        self.counts = all_counts.groupby(CUBE_KEYS, sort=True)[self.count_columns].sum().astype(np.int64).reset_index()
+
+    def save(self, prefix:str):
+        """
+        writes <prefix>_cube.csv (counts) and <prefix>_cube_hll.npy (author sketches, one row per row of the csv file)
+        """
+        folder = os.path.dirname(prefix)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.counts.to_csv(prefix + "_cube.csv", sep=";", index=False)
+        np.save(prefix + "_cube_hll.npy", self.sketches)
+
+    @classmethod
+    def load(cls, prefix:str, keywords=None):
+        """
+        reads a cube written by save
+        Args:
+            keywords: keyword categories of the cube, needed to add rows to a cube with keyword columns (e.g. incremental_update.py)
+        """
+        cube = cls(keywords)
+        counts = pd.read_csv(prefix + "_cube.csv", sep=";", parse_dates=["day"])
+        count_columns = [col for col in counts.columns if col not in CUBE_KEYS]
+        if keywords and count_columns != cube.count_columns:
+            raise ValueError(f"{prefix}_cube.csv has the columns {count_columns}, the keyword categories give {cube.count_columns}")
+        cube.counts = counts
+        cube.count_columns = count_columns
+        cube.sketches = np.load(prefix + "_cube_hll.npy")
+        return cube
+
+    @staticmethod
+    def exists(prefix:str):
+        """
+        True if a cube was saved with this prefix
+        """
+        return os.path.exists(prefix + "_cube.csv") and os.path.exists(prefix + "_cube_hll.npy")
+
+    def rollup(self, freq="M", by=("subreddit", "category"), start=None, end=None):
+        """
+        This function sums the cube up to periods
+        Args:
+            freq: "D" (days), "W-SUN" (weeks ending on sunday) or "M" (months), the period is labeled with its last day like pd.Grouper
+            by: key columns that are kept, e.g. ("subreddit",) for submissions and comments together
+            start, end: only days >= start and < end
+        returns:
+            dataframe with the columns of by, date_time (end of the period), the counts and unique_authors (HyperLogLog estimate)
+        """
+        counts = self.counts
+        keep = np.ones(len(counts), dtype=bool)
+        if start is not None:
+            keep &= (counts["day"] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            keep &= (counts["day"] < pd.Timestamp(end)).to_numpy()
+        counts = counts[keep].assign(date_time=counts.loc[keep, "day"].dt.to_period(freq).dt.end_time.dt.normalize())
+        keys = list(by) + ["date_time"]
+
+        grouped = counts.groupby(keys, sort=True)
+        rolled = grouped[self.count_columns].sum().reset_index()
+        rolled["unique_authors"] = np.round(hll_estimate(merge_sketches(grouped.ngroup().to_numpy(), self.sketches[keep], len(rolled)))).astype(np.int64)
+        return rolled
+
+    def count_over_time(self, subreddit:str, category:str):
+        """
+        counts of posts per day and per month like count_over_time in data_expl_viz.ipynb
+        returns:
+            count_per_day, count_per_month, average count per day (days with posts)
+        """
+        daily = self.rollup("D")
+        daily = daily[(daily["subreddit"] == subreddit) & (daily["category"] == category)]
+        monthly = self.rollup("M")
+        monthly = monthly[(monthly["subreddit"] == subreddit) & (monthly["category"] == category)]
+        count_per_day = daily[["date_time", "posts"]].rename(columns={"posts": "count"}).reset_index(drop=True)
+        count_per_month = monthly[["date_time", "posts"]].rename(columns={"posts": "count"}).reset_index(drop=True)
+        return count_per_day, count_per_month, count_per_day["count"].mean()
+
+    def period_average(self, column:str, start, end, freq="W-SUN", subreddit=None, denominator="posts"):
+        """
+        mean and standard deviation of a column per period (e.g. the share of posts with keywords per week) between start and end,
+        like average_timeframe in visualization_fig4and7.ipynb
+        Args:
+            column: count column, e.g. "keyword_household_chores"
+            denominator: column the counts are divided by, None for the counts themselves
+        """
+        rolled = self.rollup(freq, by=("subreddit",), start=start, end=end)
+        if subreddit is not None:
+            rolled = rolled[rolled["subreddit"] == subreddit]
+        values = rolled[column] / rolled[denominator] if denominator is not None else rolled[column]
+        return values.mean(), values.std()
+
+
+if __name__ == "__main__":
+    import preprocessing_BERTopic as preprocessing
+
+    parser = argparse.ArgumentParser(description="Build the aggregate cube of a clean csv file")
+    parser.add_argument("--csv", required=True, help='clean csv file, e.g. "mommit_clean.csv"')
+    parser.add_argument("--keywords", default=KEYWORDS_FILE, help="json file {category: [keywords]} for the keyword hit counts")
+    parser.add_argument("--output", required=True, help='prefix of the cube files, e.g. "aggregate cube/mommit"')
+    parser.add_argument("--chunksize", type=int, default=preprocessing.CHUNK_ROWS, help="rows per chunk")
+    args = parser.parse_args()
+
+    keywords = load_keywords(args.keywords)
+    cube = AggregateCube(keywords)
+    columns = ["subreddit", "category", "date_time", "created_utc", "author", "score"] + (["whole_text"] if keywords else [])
+    for chunk in preprocessing.load_csv(args.csv, columns=columns, chunksize=args.chunksize):
+        cube.add(chunk)
+    cube.save(args.output)
+    print(f"{args.output}: {len(cube):,} rows")
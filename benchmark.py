@@ -0,0 +1,407 @@
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import string
+import calendar
+import platform
+import argparse
+import logging
+import warnings
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+import zstandard
+import numpy as np
+import pandas as pd
+
+import data_dump_read
+import read_in_txt
+import preprocessing_BERTopic as preprocessing
+
+"""
+- benchmark of the pipeline stages on synthetic reddit dumps, so every performance change can be measured offline
+- generator: seeded RS_/RC_ zst files with several subreddits, nested comment trees, [deleted]/[removed] posts, AutoModerator and bot reposts.
+  The same seed and number of lines always give the same files, they are kept in "benchmark data" and reused
+- every stage (read_lines_zst, filter_dump, build_df, submissions_comments_match, load_csv, hierarchy_label, add_info, clean_comments,
+  quality_clean, title_selftext_merge, clean_text_data, last_cleaning) is timed on the output of the stage before. The peak memory of a stage
+  (python and numpy allocations, tracemalloc) is measured in an extra run, so it does not slow down the timed runs
+- title_selftext_merge is timed as clean_csv runs it (process pool, cold language cache) and also with a warm cache and in one process
+  without cache (title_selftext_merge_warm_cache, title_selftext_merge_serial), the configuration is written with the results. The peak
+  memory of the pool runs only covers the main process
+- results are written as json and can be compared with an earlier run
+    e.g. python benchmark.py --lines 10000 100000 1000000 --output before.json
+         python benchmark.py --lines 10000 100000 1000000 --output after.json --compare before.json
+"""
+
+BENCHMARK_FOLDER = "benchmark data"
+# configuration of the stages that can run in more than one way, written with the results
+STAGE_CONFIGS = {
+    "title_selftext_merge": "process pool (one worker per cpu), language cache removed before each run",
+    "title_selftext_merge_warm_cache": "process pool (one worker per cpu), language cache of the run before",
+    "title_selftext_merge_serial": "one process, no language cache",
+}
+MONTH = "2020-01"
+TARGET_SUBREDDITS = ["Mommit", "daddit"]
+OTHER_SUBREDDITS = ["AskReddit", "Parenting", "pics", "news", "aww", "gaming", "cooking", "personalfinance"]
+WORDS = (
+    "the a and to of i my it is in that he she we you for was on so but with just have be baby kid kids son daughter mom dad husband wife "
+    "sleep night nap bed feeding bottle diaper school daycare work job home house dinner lunch cook clean laundry dishes tired help love "
+    "today week month year time day first old new good bad little really know think want need get got going like feel"
+).split()
+# share of the submissions, the rest are comments
+SUBMISSION_SHARE = 1 / 6
+# comments are posted to one of the last RECENT_THREADS submissions
+RECENT_THREADS = 200
+# lines per zstd frame of the generated files
+FRAME_LINES = 50000
+
+
+def base36(number:int):
+    """
+    reddit style id
+    """
+    chars = string.digits + string.ascii_lowercase
+    text = ""
+    while True:
+        number, rest = divmod(number, 36)
+        text = chars[rest] + text
+        if number == 0:
+            return text
+
+
+def random_text(rng:random.Random, min_words:int, max_words:int):
+    """
+    text of random words
+    """
+    return " ".join(rng.choices(WORDS, k=rng.randint(min_words, max_words)))
+
+
+def write_zst(path, lines):
+    """
+    writes json lines to a zst file, FRAME_LINES lines per zstd frame (like the dumps, the file has several frames). lines can be a generator,
+    only one frame is in memory at a time
+    """
+    compressor = zstandard.ZstdCompressor(level=3)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        frame = []
+        for line in lines:
+            frame.append(line + "\n")
+            if len(frame) == FRAME_LINES:
+                file.write(compressor.compress("".join(frame).encode("utf-8")))
+                frame = []
+        if frame:
+            file.write(compressor.compress("".join(frame).encode("utf-8")))
+    os.replace(tmp_path, path)
+
+
+def generate_dumps(folder, lines:int, seed:int=0, month=MONTH, target_share=0.3):
+    """
+    This function writes a synthetic submission dump (RS_<month>.zst) and comment dump (RC_<month>.zst) with the fields of the reddit dumps.
+    The lines are generated while the files are written, only id, subreddit, permalink, author and time of the submissions are kept for the comments
+    Args:
+        folder: output folder (subfolders submissions and comments like in data_dump_read.py)
+        lines: number of lines of both files together
+        seed: seed of the random generator
+        target_share: share of the posts in TARGET_SUBREDDITS
+    returns:
+        paths of the two zst files
+    """
+    rng = random.Random(seed)
+    year, month_number = map(int, month.split("-"))
+    start = calendar.timegm((year, month_number, 1, 0, 0, 0))
+    span = calendar.monthrange(year, month_number)[1] * 86400
+    n_submissions = max(int(lines * SUBMISSION_SHARE), 1)
+    n_comments = lines - n_submissions
+    authors = [f"user_{i}" for i in range(max(lines // 20, 10))]
+
+    def subreddit():
+        return rng.choice(TARGET_SUBREDDITS) if rng.random() < target_share else rng.choice(OTHER_SUBREDDITS)
+
+    # (id, subreddit, permalink, author, created) of every submission
+    threads = []
+
+    def submission_lines():
+        # bot reposts come in bursts of the same text a minute apart
+        while len(threads) < n_submissions:
+            i = len(threads)
+            created = start + i * span // n_submissions
+            sub, author, title, selftext = subreddit(), rng.choice(authors), random_text(rng, 3, 12), random_text(rng, 0, 80)
+            copies = 1
+            draw = rng.random()
+            if draw < 0.05:
+                selftext = "[removed]"
+            elif draw < 0.07:
+                title, selftext, author = "[deleted]", "[deleted]", "[deleted]"
+            elif draw < 0.09:
+                author, copies = "repost_bot", rng.randint(2, 4)
+            for copy in range(min(copies, n_submissions - i)):
+                sid = base36(len(threads) + 1000)
+                permalink = f"/r/{sub}/comments/{sid}/{'_'.join(title.split()[:3])}/"
+                threads.append((sid, sub, permalink, author, created + 60 * copy))
+                yield json.dumps({
+                    "id": sid, "subreddit": sub, "title": title, "selftext": selftext, "author": author, "created_utc": created + 60 * copy,
+                    "permalink": permalink, "num_comments": 0, "url": f"https://i.redd.it/{sid}.jpg" if rng.random() < 0.2 else f"https://www.reddit.com{permalink}",
+                    "score": rng.randint(-5, 500), "author_flair_text": None, "edited": False,
+                })
+
+    def comment_lines():
+        # comments on one of the recent submissions, more than half of them are replies to another comment (nested trees)
+        replies = {}
+        for j in range(n_comments):
+            newest = min(j * n_submissions // max(n_comments, 1), n_submissions - 1)
+            thread = rng.randint(max(newest - RECENT_THREADS, 0), newest)
+            sid, sub, permalink, thread_author, thread_created = threads[thread]
+            comments = replies.setdefault(thread, [])
+            cid = base36(10**9 + j)
+            if comments and rng.random() < 0.55:
+                parent = "t1_" + rng.choice(comments)
+            else:
+                parent = "t3_" + sid
+            comments.append(cid)
+            author, body = rng.choice(authors), random_text(rng, 1, 60)
+            draw = rng.random()
+            if draw < 0.05:
+                author, body = "[deleted]", "[deleted]"
+            elif draw < 0.09:
+                body = "[removed]"
+            elif draw < 0.11:
+                author, body = "AutoModerator", "Your post was removed because it does not follow the rules of this subreddit"
+            elif draw < 0.13:
+                author, body = "repost_bot", "Check out this great deal for parents with kids who do not sleep through the night"
+            created = max(thread_created, start + j * span // max(n_comments, 1)) + rng.randint(0, 600)
+            yield json.dumps({
+                "id": cid, "subreddit": sub, "body": body, "author": author, "created_utc": created, "parent_id": parent,
+                "link_id": "t3_" + sid, "is_submitter": author == thread_author, "permalink": f"{permalink}{cid}/",
+                "score": rng.randint(-5, 200), "author_flair_richtext": [], "author_flair_template_id": None, "author_flair_text": None, "edited": False,
+            })
+            # only the recent threads can get comments, older ones are not needed any more
+            if newest > RECENT_THREADS:
+                replies.pop(newest - RECENT_THREADS - 1, None)
+
+    paths = {kind: os.path.join(folder, kind, f"{prefix}_{month}.zst") for prefix, kind in data_dump_read.DUMP_KINDS.items()}
+    for path in paths.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_zst(paths["submissions"], submission_lines())
+    write_zst(paths["comments"], comment_lines())
+    return [paths["submissions"], paths["comments"]]
+
+
+def dump_files(lines:int, seed:int, folder=BENCHMARK_FOLDER):
+    """
+    paths of the synthetic dumps of a scale, they are generated only if they do not exist yet
+    """
+    scale_folder = os.path.join(folder, f"lines_{lines}_seed_{seed}")
+    paths = [os.path.join(scale_folder, kind, f"{prefix}_{MONTH}.zst") for prefix, kind in data_dump_read.DUMP_KINDS.items()]
+    if not all(os.path.exists(path) for path in paths):
+        paths = generate_dumps(scale_folder, lines, seed)
+    return paths
+
+
+def count_lines(files):
+    """
+    stage read_lines_zst: all lines of the dump files
+    """
+    lines = 0
+    for file_path in files:
+        for _ in data_dump_read.read_lines_zst(file_path):
+            lines += 1
+    return lines
+
+
+def filter_dumps(files, output_folder):
+    """
+    stage filter_dump: txt files of TARGET_SUBREDDITS (the output folder is emptied first, so every timed run is a first run without checkpoints)
+    """
+    shutil.rmtree(output_folder, ignore_errors=True)
+    os.makedirs(output_folder)
+    written = {}
+    for file_path in files:
+        written.update(data_dump_read.filter_dump(file_path, TARGET_SUBREDDITS, output_folder))
+    return written
+
+
+def build_frames(txt_folder):
+    """
+    stage build_df: submissions and comments of the first target subreddit (build_df, rel_submissions, rel_comments)
+    """
+    name = TARGET_SUBREDDITS[0].lower()
+    df_submissions = read_in_txt.rel_submissions(read_in_txt.build_df([f"{name}_submissions_{MONTH}.txt"], txt_folder))
+    df_comments = read_in_txt.rel_comments(read_in_txt.build_df([f"{name}_comments_{MONTH}.txt"], txt_folder))
+    return df_submissions, df_comments
+
+
+def pipeline_stages(files, work_folder):
+    """
+    stages of the pipeline: (name, setup, run). setup(previous result) returns the arguments of run (not timed), run returns the result
+    for the next stage
+    """
+    txt_folder = os.path.join(work_folder, "filtered text files")
+    csv_path = os.path.join(work_folder, "subs_comments_final.csv")
+
+    cache_path = os.path.join(work_folder, "language_cache.json")
+
+    def write_csv(matched):
+        matched.to_csv(csv_path, sep=";")
+        return (csv_path,)
+
+    def cold_cache(previous):
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        return (previous.copy(), cache_path, None)
+
+    return [
+        ("read_lines_zst", lambda previous: (files,), count_lines),
+        ("filter_dump", lambda previous: (files, txt_folder), filter_dumps),
+        ("build_df", lambda previous: (txt_folder,), build_frames),
+        ("submissions_comments_match", lambda previous: (*previous, previous[0]["permalink"].values.tolist()), read_in_txt.submissions_comments_match),
+        ("load_csv", write_csv, preprocessing.load_csv),
+        ("hierarchy_label", lambda previous: (previous.copy(),), preprocessing.hierarchy_label),
+        ("add_info", lambda previous: (previous.copy(),), preprocessing.add_info),
+        ("clean_comments", lambda previous: (previous,), preprocessing.clean_comments),
+        ("quality_clean", lambda previous: (previous,), lambda df: preprocessing.quality_clean(df)[0]),
+        # as in clean_csv: process pool and language cache, the cache is removed before every timed run (first run over a month)
+        ("title_selftext_merge", cold_cache, preprocessing.title_selftext_merge),
+        # the same with the cache of the run before (rerun over the same month), the input already has whole_text and language
+        ("title_selftext_merge_warm_cache", lambda previous: (previous.copy(), cache_path, None), preprocessing.title_selftext_merge),
+        ("title_selftext_merge_serial", lambda previous: (previous.copy(), None, 1), preprocessing.title_selftext_merge),
+        ("clean_text_data", lambda previous: (previous,), preprocessing.clean_text_data),
+        ("last_cleaning", lambda previous: (previous,), preprocessing.last_cleaning),
+    ]
+
+
+def result_rows(result):
+    """
+    number of rows (lines) of a stage result
+    """
+    if isinstance(result, (int, np.integer)):
+        return int(result)
+    if isinstance(result, dict):
+        return int(sum(result.values()))
+    if isinstance(result, tuple):
+        return sum(len(part) for part in result)
+    return len(result)
+
+
+def run_benchmark(lines:int, seed:int=0, repeat:int=1, memory:bool=True, stages=None, folder=BENCHMARK_FOLDER):
+    """
+    This function runs the pipeline stages on the synthetic dumps of one scale
+    Args:
+        lines: lines of the synthetic dumps
+        seed: seed of the generator
+        repeat: timed runs per stage, the fastest one is reported
+        memory: measure the peak memory of each stage in an extra run (tracemalloc)
+        stages: names of the stages to report, None for all (the stages before them run anyway, their output is needed)
+    returns:
+        list of results, one per stage: lines, stage, config (see STAGE_CONFIGS), seconds, peak_mb, rows_in, rows_out, rows_per_s
+    """
+    files = dump_files(lines, seed, folder)
+    work_folder = os.path.join(folder, f"lines_{lines}_seed_{seed}", "work")
+    results = []
+    previous = None
+    rows_in = lines
+    for name, setup, run in pipeline_stages(files, work_folder):
+        report = stages is None or name in stages
+        seconds = []
+        for _ in range(repeat if report else 1):
+            args = setup(previous)
+            begin = time.perf_counter()
+            result = run(*args)
+            seconds.append(time.perf_counter() - begin)
+
+        peak_mb = None
+        if report and memory:
+            args = setup(previous)
+            tracemalloc.start()
+            run(*args)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+
+        rows_out = result_rows(result)
+        if report:
+            results.append({
+                "lines": lines, "stage": name, "config": STAGE_CONFIGS.get(name), "seconds": round(min(seconds), 4), "peak_mb": None if peak_mb is None else round(peak_mb, 1),
+                "rows_in": rows_in, "rows_out": rows_out, "rows_per_s": round(rows_in / min(seconds)) if min(seconds) > 0 else None,
+            })
+            print(f"{lines:>10,} {name:<32} {min(seconds):>9.3f} s {'' if peak_mb is None else f'{peak_mb:>9.1f} MB'} {rows_in:>10,} -> {rows_out:,}")
+        previous = result
+        rows_in = rows_out
+    return results
+
+
+def run_metadata(seed:int, repeat:int, memory:bool):
+    """
+    everything that is needed to decide if two result files are comparable
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "seed": seed,
+        "repeat": repeat,
+        "memory": memory,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare_results(old, new):
+    """
+    prints the time and peak memory of the new results relative to the old ones (same lines, stage and configuration)
+    """
+    old_runs = {(run["lines"], run["stage"], run.get("config")): run for run in old["results"]}
+    print(f"compared with {old['meta'].get('commit')} ({old['meta'].get('date')})")
+    for run in new["results"]:
+        before = old_runs.get((run["lines"], run["stage"], run.get("config")))
+        if before is None:
+            continue
+        ratio = run["seconds"] / before["seconds"] if before["seconds"] else float("nan")
+        memory = ""
+        if run["peak_mb"] is not None and before.get("peak_mb"):
+            memory = f"{before['peak_mb']:>9.1f} -> {run['peak_mb']:>9.1f} MB"
+        print(f"{run['lines']:>10,} {run['stage']:<32} {before['seconds']:>9.3f} -> {run['seconds']:>9.3f} s ({ratio:.2f}x) {memory}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic reddit dumps")
+    parser.add_argument("--lines", nargs="+", type=int, default=[10000, 100000], help="lines of the synthetic dumps, one run per scale (e.g. 10000 ... 10000000)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per stage, the fastest one is reported")
+    parser.add_argument("--stages", nargs="*", default=None, help="stages to report, default: all")
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra run per stage that measures the peak memory")
+    parser.add_argument("--folder", default=BENCHMARK_FOLDER, help="folder for the synthetic dumps and intermediate files")
+    parser.add_argument("--output", default="benchmark_results.json", help="json file for the results")
+    parser.add_argument("--compare", default=None, help="json file of an earlier run to compare with")
+    parser.add_argument("--generate-only", action="store_true", help="only generate the synthetic dumps")
+    args = parser.parse_args()
+
+    # progress lines of filter_dump and pandas warnings would hide the results
+    data_dump_read.log.setLevel(logging.WARNING)
+    warnings.simplefilter("ignore")
+
+    if args.generate_only:
+        for lines in args.lines:
+            print(dump_files(lines, args.seed, args.folder))
+        sys.exit(0)
+
+    results = {"meta": run_metadata(args.seed, args.repeat, not args.no_memory), "results": []}
+    for lines in args.lines:
+        results["results"].extend(run_benchmark(lines, args.seed, args.repeat, not args.no_memory, args.stages, args.folder))
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            compare_results(json.load(file), results)
@@ -3,86 +3,562 @@
 - each month has its own zst file
 - 2 folders in current working directory: submissions and comments. In the folders lie the respective .zst files
 - one txt files is created for each month, each subreddit and whether post is a submission or a comment 
+- each zst file is decompressed only once, all subreddits of interest are filtered in the same pass
+  e.g. python data_dump_read.py --subreddits Mommit daddit --files "submissions/RS_*.zst" "comments/RC_*.zst"
 """
 
 # libraries
 import zstandard
 import os
 import json
+import glob
+import argparse
+import signal
+import sys
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 import logging.handlers
+import re
+
+from instrumentation import Run, Progress
+
+# orjson parses a lot faster than json, use it if it is installed
+try:
+	import orjson
+	json_loads = orjson.loads
+except ImportError:
+	json_loads = json.loads
 
 # set up logging
 log = logging.getLogger("bot")
 log.setLevel(logging.DEBUG)
 log.addHandler(logging.StreamHandler())
 
+# prefix of the dump file name -> kind of post, as used in the names of the txt files
+DUMP_KINDS = {"RS": "submissions", "RC": "comments"}
+
+# the dumps are compressed with a long window, each reader can claim up to 2 GB for it
+MAX_WINDOW_SIZE = 2**31
+# compressed bytes read at once, decompressed they are roughly ten times as large
+CHUNK_SIZE = 2**24
+# write buffer of each open txt file
+WRITE_BUFFER_SIZE = 2**22
+# rough memory need of one reader: window + decompressed chunk + line buffer
+WORKER_MEMORY = MAX_WINDOW_SIZE + 32 * CHUNK_SIZE
+# lines after which the txt files are flushed and synced to disk and a checkpoint is written
+CHECKPOINT_LINES = 10_000_000
+# lines per record batch when the txt files are written to parquet
+PARQUET_BATCH_LINES = 100_000
 
-def read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
-	chunk = reader.read(chunk_size)
-	bytes_read += chunk_size
-	if previous_chunk is not None:
-		chunk = previous_chunk + chunk
-	try:
-		return chunk.decode()
-	except UnicodeDecodeError:
-		if bytes_read > max_window_size:
-			raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
-		log.info(f"Decoding error with {bytes_read:,} bytes, reading another chunk")
-		return read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
+# columns read_in_txt.py uses and their types in the parquet files. category and subreddit are not stored in the
+# files, they are the partition folders (category=comments/subreddit=mommit/month=2019-12). category is the top
+# level, so all files below one category folder have the same columns. The subreddit is lower case like in the txt file
+# names (output_txt_name), read_in_txt.py takes the subreddit column with its case from the permalink
+PARQUET_COLUMNS = {
+	"submissions": {
+		"title": "string", "selftext": "string", "author": "string", "permalink": "string", "id": "string",
+		"num_comments": "int64", "url": "string", "score": "int64", "author_flair_text": "string", "edited": "double",
+		"created_utc": "int64",
+	},
+	"comments": {
+		"body": "string", "author": "string", "parent_id": "string", "link_id": "string", "is_submitter": "bool",
+		"permalink": "string", "id": "string", "score": "int64", "author_flair_richtext": "string",
+		"author_flair_template_id": "string", "author_flair_text": "string", "edited": "double", "created_utc": "int64",
+	},
+}
 
 
-def read_lines_zst(file_name):
+def read_lines_zst(file_name, position=(0, 0)):
+	"""
+	yields the lines of a zst file as raw bytes (without decoding) together with the compressed bytes read so far and
+	the position right after the line. A position is (offset of the zstd frame in the zst file, decompressed bytes into
+	that frame), so reading can start again at any yielded position without decompressing the frames before it.
+	Args:
+		file_name: path to the zst file
+		position: position to start reading from, (0, 0) is the start of the file
+	"""
+	frame_offset, skip = position
+	decompressor = zstandard.ZstdDecompressor(max_window_size=MAX_WINDOW_SIZE)
 	with open(file_name, 'rb') as file_handle:
-		buffer = ''
-		reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
+		file_handle.seek(frame_offset)
+		decompressobj = decompressor.decompressobj()
+		frame_bytes = 0 # decompressed bytes of the current frame before chunk
+		buffer = b''
+		data = b''
 		while True:
-			chunk = read_and_decode(reader, 2**27, (2**29) * 2)
-
-			if not chunk:
+			data = data or file_handle.read(CHUNK_SIZE)
+			if not data:
 				break
-			lines = (buffer + chunk).split("\n")
+			chunk = decompressobj.decompress(data)
+			data = b''
+
+			# on resume drop the part of the frame that was already read
+			if skip:
+				skipped = min(skip, len(chunk))
+				chunk = chunk[skipped:]
+				skip -= skipped
+				frame_bytes += skipped
 
+			lines = (buffer + chunk).split(b"\n")
+			line_end = frame_bytes - len(buffer)
 			for line in lines[:-1]:
-				yield line, file_handle.tell()
+				line_end += len(line) + 1
+				yield line, file_handle.tell(), (frame_offset, line_end)
 
 			buffer = lines[-1]
+			frame_bytes += len(chunk)
 
-		reader.close()
+			# a frame ended: the rest of the read data belongs to the next frame
+			if decompressobj.eof:
+				data = decompressobj.unused_data
+				frame_offset = file_handle.tell() - len(data)
+				decompressobj = decompressor.decompressobj()
+				frame_bytes = 0
 
 
-if __name__ == "__main__":
-	cwd=os.getcwd()
-	data_folder= "comments" # folder with .rst files; switch to "submissions" if you want to read in submissions
-	file_name= "RC_2019-12.zst" # switch to correct file name (Month and comment vs submission)
-	file_path= os.path.join(cwd, data_folder, file_name)
+def subreddit_prefilter(subreddits):
+	"""
+	builds a search function that works on the raw bytes of a line. It only finds lines with a "subreddit":"..." field
+	of one of the subreddits, all other lines can be dropped without decoding and parsing them.
+	The check is only a prefilter, lines that pass are parsed and checked again.
+	"""
+	names = b"|".join(re.escape(subreddit.encode("utf-8")) for subreddit in subreddits)
+	return re.compile(rb'"subreddit"\s*:\s*"(?:' + names + rb')"', re.IGNORECASE).search
+
+
+class TxtWriters:
+	"""
+	keeps the txt files open for the whole run instead of opening and closing them for every line.
+	Lines are written as the raw bytes from the dump with large write buffers. checkpoint() flushes and syncs all
+	files to disk, leaving the with block (also on an interrupt) does a last checkpoint and closes them.
+	"""
+
+	def __init__(self, buffer_size=WRITE_BUFFER_SIZE):
+		self.buffer_size = buffer_size
+		self.files = {}
+
+	def write(self, file_path, line):
+		file = self.files.get(file_path)
+		if file is None:
+			file = self.files[file_path] = open(file_path, "ab", buffering=self.buffer_size)
+		file.write(line)
+		file.write(b"\n") # add a key wrap after each dictionary
+
+	def checkpoint(self):
+		for file in self.files.values():
+			file.flush()
+			os.fsync(file.fileno())
+
+	def close(self):
+		try:
+			self.checkpoint()
+		finally:
+			for file in self.files.values():
+				file.close()
+			self.files = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+def dump_kind_month(file_path):
+	"""
+	reads kind (submissions/comments) and month from the name of a dump file, e.g. RC_2019-12.zst -> ("comments", "2019-12")
+	"""
+	file_name = os.path.basename(file_path)
+	prefix, month = file_name.split(".")[0].split("_", 1)
+	if prefix not in DUMP_KINDS:
+		raise ValueError(f"Unknown dump file {file_name}, expected RS_<month>.zst or RC_<month>.zst")
+	return DUMP_KINDS[prefix], month
+
+
+def output_txt_name(subreddit, kind, month):
+	"""
+	name of the txt file for one subreddit, kind and month, e.g. mommit_comments_2019-12.txt (naming read_in_txt.py expects)
+	"""
+	return f"{subreddit.lower()}_{kind}_{month}.txt"
+
+
+def expand_dump_files(patterns):
+	"""
+	expands a list of file names and/or glob patterns to a sorted list of existing dump files (no file twice)
+	"""
+	files = set()
+	for pattern in patterns:
+		matches = glob.glob(pattern)
+		if not matches:
+			log.warning(f"No dump file found for {pattern}")
+		files.update(os.path.abspath(match) for match in matches)
+	return sorted(files)
+
+
+def checkpoint_path(file_path, output_folder):
+	"""
+	checkpoint file of a dump file, e.g. RC_2019-12.checkpoint.json in the output folder
+	"""
+	return os.path.join(output_folder, os.path.basename(file_path).split(".")[0] + ".checkpoint.json")
+
+
+def read_checkpoint(path):
+	"""
+	returns the last committed checkpoint or None if there is none
+	"""
+	if not os.path.exists(path):
+		return None
+	with open(path, "r", encoding="utf-8") as file:
+		return json.load(file)
+
+
+def write_checkpoint(path, checkpoint):
+	"""
+	writes the checkpoint to a temporary file and replaces the old one, so a crash never leaves half a checkpoint
+	"""
+	tmp_path = path + ".tmp"
+	with open(tmp_path, "w", encoding="utf-8") as file:
+		json.dump(checkpoint, file, indent=2)
+		file.flush()
+		os.fsync(file.fileno())
+	os.replace(tmp_path, path)
+
+
+def filter_dump(file_path, subreddits, output_folder, resume=False):
+	"""
+	decompresses one dump file once and writes the lines of all subreddits of interest into their own txt file.
+	Every CHECKPOINT_LINES lines the txt files are synced and a checkpoint with the read position in the dump and the
+	sizes of the txt files is written. With resume the run continues at the last checkpoint; txt files are truncated
+	to the size they had then, so lines are never written twice. Without resume an existing checkpoint of the dump is
+	started over: the txt files are truncated to the size they had before its first run (start_outputs).
+	Args:
+		file_path: path to a RS_ or RC_ zst file
+		subreddits: names of the subreddits of interest (case insensitive)
+		output_folder: folder for the txt files
+		resume: continue from the checkpoint of an earlier run
+	returns:
+		dictionary with the number of written lines per txt file
+	"""
+	kind, month = dump_kind_month(file_path)
+	# lower case subreddit -> txt file of this dump
+	targets = {
+		subreddit.lower(): os.path.join(output_folder, output_txt_name(subreddit, kind, month)) for subreddit in subreddits
+	}
+	prefilter = subreddit_prefilter(subreddits)
+	path_checkpoint = checkpoint_path(file_path, output_folder)
 
 	file_size = os.stat(file_path).st_size
-	file_lines = 0
 	file_bytes_processed = 0
 	created = None
-	bad_lines = 0
 
-	new_folder = "filtered text files"
-	os.makedirs(os.path.join(cwd, new_folder), exist_ok=True)  # Create the new folder if it doesn't exist
-	
-	for line, file_bytes_processed in read_lines_zst(file_path):
-		try:
-			# filtered data is stored in txt format, manually name it
-			new_txt="abcd.txt" 
-			file_path_new_txt=os.path.join(cwd,new_folder, new_txt)
-			obj = json.loads(line)
-			created = datetime.utcfromtimestamp(int(obj['created_utc']))
-			
-			if obj['subreddit'] == "Mommit":
-				with open(file_path_new_txt, "a", encoding="utf-8") as file:
-					file.write(json.dumps(obj) + "\n") # add a key wrap after each dictionary
-				
-		except (KeyError, json.JSONDecodeError) as err:
-			bad_lines += 1
-		file_lines += 1
-		if file_lines % 100000 == 0:
-			log.info(f"{created.strftime('%Y-%m-%d %H:%M:%S')} : {file_lines:,} : {bad_lines:,} : {file_bytes_processed:,}:{(file_bytes_processed / file_size) * 100:.0f}%")
-
-
-	log.info(f"Complete : {file_lines:,} : {bad_lines:,}")
+	checkpoint = read_checkpoint(path_checkpoint)
+	if checkpoint is not None and checkpoint["outputs"].keys() != {os.path.basename(path) for path in targets.values()}:
+		raise ValueError(
+			f"{path_checkpoint} was written for other subreddits, use the same subreddits with --resume or delete it and its txt files"
+		)
+	if checkpoint is not None and not resume:
+		# a rerun goes back to the txt files as they were before the first run of this dump, otherwise every line
+		# would be appended a second time
+		if "start_outputs" not in checkpoint:
+			raise ValueError(f"{path_checkpoint} exists, continue with --resume or delete it and its txt files")
+		log.info(f"Starting {file_path} over, the txt files are truncated to their size before its first run")
+		start_outputs = checkpoint["start_outputs"]
+		checkpoint = None
+	else:
+		# the txt files as they are before this run
+		start_outputs = {os.path.basename(path): os.path.getsize(path) if os.path.exists(path) else 0 for path in targets.values()}
+	if checkpoint is None:
+		# a resume goes back to outputs (the sizes at the last checkpoint), a rerun to start_outputs
+		checkpoint = {
+			"dump": os.path.basename(file_path),
+			"position": [0, 0],
+			"file_lines": 0,
+			"bad_lines": 0,
+			"outputs": dict(start_outputs),
+			"start_outputs": start_outputs,
+			"written": {os.path.basename(path): 0 for path in targets.values()},
+			"complete": False,
+		}
+		write_checkpoint(path_checkpoint, checkpoint)
+	elif checkpoint["complete"]:
+		log.info(f"Skipping {file_path}, it was completely read before")
+		return {os.path.join(output_folder, txt): count for txt, count in checkpoint["written"].items()}
+	else:
+		log.info(f"Resuming {file_path} at line {checkpoint['file_lines']:,}")
+
+	# drop everything written after the checkpoint
+	for txt, size in checkpoint["outputs"].items():
+		with open(os.path.join(output_folder, txt), "ab") as file:
+			file.truncate(size)
+
+	file_lines = checkpoint["file_lines"]
+	bad_lines = checkpoint["bad_lines"]
+	written = {os.path.join(output_folder, txt): count for txt, count in checkpoint["written"].items()}
+	position = tuple(checkpoint["position"])
+
+	def commit(complete=False):
+		writers.checkpoint()
+		checkpoint.update({
+			"position": list(position),
+			"file_lines": file_lines,
+			"bad_lines": bad_lines,
+			"outputs": {os.path.basename(path): os.path.getsize(path) for path in targets.values()},
+			"written": {os.path.basename(path): count for path, count in written.items()},
+			"complete": complete,
+		})
+		write_checkpoint(path_checkpoint, checkpoint)
+
+	log.info(f"Reading {file_path} for {', '.join(subreddits)}")
+	progress = Progress(os.path.basename(file_path), file_size, position[0], file_lines, log)
+	with TxtWriters() as writers:
+		for line, file_bytes_processed, position in read_lines_zst(file_path, position):
+			file_lines += 1
+			# lines of other subreddits are dropped before they are decoded or parsed
+			if prefilter(line) is not None:
+				try:
+					obj = json_loads(line)
+					file_path_new_txt = targets.get(obj['subreddit'].lower())
+					if file_path_new_txt is not None:
+						created = datetime.utcfromtimestamp(int(obj['created_utc']))
+						# the original line is written, no need to serialize obj again
+						writers.write(file_path_new_txt, line)
+						written[file_path_new_txt] += 1
+
+				except (KeyError, AttributeError, TypeError, ValueError) as err: # ValueError includes JSONDecodeError and UnicodeDecodeError
+					bad_lines += 1
+			if file_lines % 100000 == 0:
+				# created is None as long as no line of the subreddits was parsed
+				last_created = created.strftime('%Y-%m-%d %H:%M:%S') if created is not None else "-"
+				progress.update(file_lines, file_bytes_processed, f"{last_created} : {bad_lines:,} bad")
+			if file_lines % CHECKPOINT_LINES == 0:
+				commit()
+		commit(complete=True)
+
+	log.info(f"Complete {os.path.basename(file_path)} : {file_lines:,} : {bad_lines:,}")
+	return written
+
+
+def worker_count(n_files, workers, memory_limit=None):
+	"""
+	number of worker processes: not more than files, requested workers and what fits into the memory limit (in bytes)
+	"""
+	count = max(1, min(n_files, workers))
+	if memory_limit is not None:
+		fitting = int(memory_limit // WORKER_MEMORY)
+		if fitting < 1:
+			raise ValueError(f"Memory limit of {memory_limit:,} bytes is below the {WORKER_MEMORY:,} bytes one reader needs")
+		count = min(count, fitting)
+	return count
+
+
+def filter_dump_shard(file_path, subreddits, shard_folder, resume=False, parquet_folder=None):
+	"""
+	worker job: filters one dump file into its own shard folder. Without resume the shard folder is created freshly
+	(reruns never append to old shards), with resume the shard continues from its checkpoint.
+	With a parquet_folder the parquet partitions of this dump are written by the worker as well.
+	"""
+	if not resume:
+		shutil.rmtree(shard_folder, ignore_errors=True)
+	os.makedirs(shard_folder, exist_ok=True)
+	written = filter_dump(file_path, subreddits, shard_folder, resume)
+	if parquet_folder is not None:
+		write_parquet(file_path, subreddits, shard_folder, parquet_folder)
+	return written
+
+
+def merge_shards(shard_folders, output_folder):
+	"""
+	concatenates the txt files of all shards into the output folder. Shards are merged in the order of shard_folders,
+	so the same input always gives byte identical txt files. A manifest.json with line count, size and sha256 of each
+	txt file and the dumps it was built from is written next to them.
+	Args:
+		shard_folders: shard folders, sorted like the dump files they come from
+		output_folder: folder for the merged txt files
+	returns:
+		manifest as dictionary
+	"""
+	sources = {}
+	for shard_folder in shard_folders:
+		for txt in sorted(file for file in os.listdir(shard_folder) if file.endswith(".txt")):
+			sources.setdefault(txt, []).append(os.path.join(shard_folder, txt))
+
+	manifest = {}
+	for txt in sorted(sources):
+		file_path_new_txt = os.path.join(output_folder, txt)
+		sha256 = hashlib.sha256()
+		lines = 0
+		with open(file_path_new_txt, "wb") as merged:
+			for shard in sources[txt]:
+				with open(shard, "rb") as file:
+					for block in iter(lambda: file.read(2**24), b""):
+						merged.write(block)
+						sha256.update(block)
+						lines += block.count(b"\n")
+		manifest[txt] = {
+			"lines": lines,
+			"bytes": os.path.getsize(file_path_new_txt),
+			"sha256": sha256.hexdigest(),
+			"dumps": [os.path.basename(os.path.dirname(shard)) for shard in sources[txt]],
+		}
+
+	with open(os.path.join(output_folder, "manifest.json"), "w", encoding="utf-8") as file:
+		json.dump(manifest, file, indent=2, sort_keys=True)
+	return manifest
+
+
+def ingest_parallel(files, subreddits, output_folder, workers, memory_limit=None, resume=False, parquet_folder=None):
+	"""
+	filters the dump files in parallel, one file per worker process. Each worker writes into its own shard folder
+	(output_folder/shards/<dump file>), afterwards the shards are merged deterministically and removed.
+	Args:
+		files: sorted list of RS_/RC_ zst files
+		subreddits: names of the subreddits of interest
+		output_folder: folder for the txt files
+		workers: maximum number of worker processes
+		memory_limit: memory ceiling in bytes for all readers together, limits the number of workers
+		resume: continue the shards of an earlier, interrupted run from their checkpoints
+		parquet_folder: if given, parquet partitions are written there as well
+	returns:
+		manifest of the merged txt files
+	"""
+	shard_root = os.path.join(output_folder, "shards")
+	shard_folders = [os.path.join(shard_root, os.path.basename(file_path).split(".")[0]) for file_path in files]
+	max_workers = worker_count(len(files), workers, memory_limit)
+	log.info(f"Filtering {len(files)} dump files with {max_workers} worker processes")
+
+	with ProcessPoolExecutor(max_workers=max_workers) as executor:
+		futures = {
+			executor.submit(filter_dump_shard, file_path, subreddits, shard_folder, resume, parquet_folder): file_path
+			for file_path, shard_folder in zip(files, shard_folders)
+		}
+		for future in as_completed(futures):
+			written = future.result()
+			log.info(f"Done {os.path.basename(futures[future])} : {sum(written.values()):,} lines")
+
+	manifest = merge_shards(shard_folders, output_folder)
+	shutil.rmtree(shard_root)
+	return manifest
+
+
+def parquet_value(value, arrow_type):
+	"""
+	converts a value of a dump line to the type of its parquet column
+	- edited is false or the time of the edit: stored as 0.0 or the timestamp (1.0 if only true is known)
+	- lists and dictionaries (author_flair_richtext) are stored as json strings, read_in_txt.build_df_parquet decodes them
+	"""
+	if value is None:
+		return None
+	if arrow_type == "int64":
+		return int(value)
+	if arrow_type == "double":
+		return float(value)
+	if arrow_type == "string" and not isinstance(value, str):
+		return json.dumps(value)
+	return value
+
+
+def txt_to_parquet(txt_path, parquet_path, kind, batch_lines=PARQUET_BATCH_LINES):
+	"""
+	writes the relevant columns of a txt file with dump lines into a parquet file, in batches so the lines are never
+	all in memory
+	Args:
+		txt_path: txt file written by filter_dump
+		parquet_path: parquet file to write
+		kind: submissions or comments, decides the columns (PARQUET_COLUMNS)
+		batch_lines: lines per record batch
+	returns:
+		number of written rows
+	"""
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+
+	columns = PARQUET_COLUMNS[kind]
+	schema = pa.schema([(name, pa.type_for_alias(arrow_type)) for name, arrow_type in columns.items()])
+
+	def to_batch(objs):
+		return pa.RecordBatch.from_pydict(
+			{name: [parquet_value(obj.get(name), arrow_type) for obj in objs] for name, arrow_type in columns.items()},
+			schema=schema,
+		)
+
+	rows = 0
+	os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+	tmp_path = parquet_path + ".tmp"
+	with pq.ParquetWriter(tmp_path, schema) as writer, open(txt_path, "rb") as file:
+		objs = []
+		for line in file:
+			objs.append(json_loads(line))
+			if len(objs) == batch_lines:
+				writer.write_batch(to_batch(objs))
+				rows += len(objs)
+				objs = []
+		writer.write_batch(to_batch(objs))
+		rows += len(objs)
+	os.replace(tmp_path, parquet_path)
+	return rows
+
+
+def write_parquet(file_path, subreddits, txt_folder, parquet_folder):
+	"""
+	writes the txt files of one dump as parquet partitions parquet_folder/category=.../subreddit=.../month=.../part-0.parquet
+	(subreddit in lower case, like the txt file names)
+	"""
+	kind, month = dump_kind_month(file_path)
+	for subreddit in subreddits:
+		txt_path = os.path.join(txt_folder, output_txt_name(subreddit, kind, month))
+		if not os.path.exists(txt_path):
+			continue
+		partition = os.path.join(parquet_folder, f"category={kind}", f"subreddit={subreddit.lower()}", f"month={month}")
+		rows = txt_to_parquet(txt_path, os.path.join(partition, "part-0.parquet"), kind)
+		log.info(f"{partition} : {rows:,} rows")
+
+
+if __name__ == "__main__":
+	cwd=os.getcwd()
+	parser = argparse.ArgumentParser(description="Filter reddit zst dumps for subreddits of interest")
+	parser.add_argument("--subreddits", nargs="+", default=["Mommit", "daddit"], help="subreddits to keep")
+	parser.add_argument(
+		"--files", nargs="+", default=[os.path.join(cwd, "submissions", "RS_*.zst"), os.path.join(cwd, "comments", "RC_*.zst")],
+		help="RS_/RC_ zst files or glob patterns (quote them)",
+	)
+	parser.add_argument("--output", default=os.path.join(cwd, "filtered text files"), help="folder for the txt files")
+	parser.add_argument("--workers", type=int, default=1, help="worker processes, one dump file per worker (1 = no pool)")
+	parser.add_argument("--memory-limit", type=float, default=None, help="memory ceiling in GB for all workers together")
+	parser.add_argument("--resume", action="store_true", help="continue from the checkpoints of an interrupted run")
+	parser.add_argument("--parquet", default=None, help="folder for parquet partitions (category/subreddit/month), needs pyarrow")
+	parser.add_argument("--trace", default=None, help="json file for the stages of the run (time, lines, MB/s, memory)")
+	parser.add_argument("--profile", default=None, help="file for the cProfile stats of the run")
+	args = parser.parse_args()
+
+	# on SIGTERM (e.g. preemption of the node) exit like on Ctrl+C, so the txt files are flushed and closed
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+	os.makedirs(args.output, exist_ok=True)  # Create the new folder if it doesn't exist
+	files = expand_dump_files(args.files)
+
+	with Run("data_dump_read", args.trace, args.profile, log) as run:
+		if args.workers > 1:
+			memory_limit = args.memory_limit * 2**30 if args.memory_limit is not None else None
+			with run.stage("ingest_parallel", bytes_in=sum(os.stat(file_path).st_size for file_path in files)) as record:
+				manifest = ingest_parallel(
+					files, args.subreddits, args.output, args.workers, memory_limit, args.resume, args.parquet
+				)
+				record["rows_out"] = sum(entry["lines"] for entry in manifest.values())
+			for txt, entry in manifest.items():
+				log.info(f"{txt} : {entry['lines']:,} lines")
+			run.note("written", {txt: entry["lines"] for txt, entry in manifest.items()})
+		else:
+			for file_path in files:
+				with run.stage("filter_dump", bytes_in=os.stat(file_path).st_size) as record:
+					written = filter_dump(file_path, args.subreddits, args.output, args.resume)
+					checkpoint = read_checkpoint(checkpoint_path(file_path, args.output))
+					record["rows_in"] = checkpoint["file_lines"]
+					record["rows_out"] = sum(written.values())
+				run.note(os.path.basename(file_path), {"lines": checkpoint["file_lines"], "bad_lines": checkpoint["bad_lines"]})
+				if args.parquet is not None:
+					with run.stage("write_parquet"):
+						write_parquet(file_path, args.subreddits, args.output, args.parquet)
+				for path, count in written.items():
+					log.info(f"{os.path.basename(path)} : {count:,} lines")
@@ -0,0 +1,143 @@
+import os
+import re
+import json
+import numpy as np
+
+from text_keys import text_hash
+
+"""
+- persistent store of the sentence embeddings of the documents (whole_text) for the BERTopic models
+- one folder per embedding model in "embedding cache": the vectors are one memory mapped array on disk (float16 by default), keys.txt holds
+  the sha1 of the text of each row. A document is encoded only once per model, refitting BERTopic with other parameters (min_topic_size,
+  UMAP, HDBSCAN) reads the embeddings from the cache
+- only the missing documents are encoded (in batches), new rows are appended to the array
+- usage:
+    embeddings = embed_documents(docs)
+    topic_model = BERTopic(embedding_model=EMBEDDING_MODEL, min_topic_size=30)
+    topics, probs = topic_model.fit_transform(docs, embeddings=embeddings)
+"""
+
+CACHE_FOLDER = "embedding cache"
+# default embedding model of BERTopic for english documents
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# documents encoded and appended to the cache at once, an interrupted run keeps the embeddings of the finished chunks
+ENCODE_CHUNK = 10000
+
+
+def model_folder(model_name:str, folder=CACHE_FOLDER):
+    """
+    folder of the cache of an embedding model (characters that are not allowed in folder names are replaced)
+    """
+    return os.path.join(folder, re.sub(r"[^A-Za-z0-9._-]+", "_", model_name))
+
+
+class EmbeddingCache:
+    """
+    This class stores the embeddings of one embedding model on disk.
+    Args:
+        model_name: name of the sentence_transformers model
+        folder: folder of all caches
+        dtype: "float16" (half the disk space and memory) or "float32"
+    """
+
+    def __init__(self, model_name:str, folder=CACHE_FOLDER, dtype="float16"):
+        self.model_name = model_name
+        self.folder = model_folder(model_name, folder)
+        self.meta_path = os.path.join(self.folder, "meta.json")
+        self.keys_path = os.path.join(self.folder, "keys.txt")
+        self.vectors_path = os.path.join(self.folder, "vectors.bin")
+
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            # an existing cache keeps its dtype
+            self.dtype = np.dtype(meta["dtype"])
+            self.dim = meta["dim"]
+
+        # the keys are written after the vectors, rows without a key (interrupted append) are overwritten by the next append
+        self.rows = {}
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r", encoding="utf-8") as file:
+                for row, key in enumerate(file.read().split()):
+                    self.rows[key] = row
+
+    def __len__(self):
+        return len(self.rows)
+
+    def vectors(self):
+        """
+        memory mapped array (rows x dim) of all embeddings in the cache, read only
+        """
+        if not self.rows:
+            return np.zeros((0, self.dim or 0), dtype=self.dtype)
+        return np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(len(self.rows), self.dim))
+
+    def add(self, keys, vectors:np.ndarray):
+        """
+        appends the embeddings of new documents
+        Args:
+            keys: text hashes of the documents (not in the cache yet)
+            vectors: embeddings, one row per key
+        """
+        vectors = np.asarray(vectors)
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            os.makedirs(self.folder, exist_ok=True)
+            with open(self.meta_path, "w", encoding="utf-8") as file:
+                json.dump({"model": self.model_name, "dim": self.dim, "dtype": self.dtype.name}, file)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embeddings have {vectors.shape[1]} dimensions, the cache of {self.model_name} has {self.dim}")
+
+        with open(self.vectors_path, "ab") as file:
+            file.truncate(len(self.rows) * self.dim * self.dtype.itemsize)
+            file.write(vectors.astype(self.dtype).tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        with open(self.keys_path, "a", encoding="utf-8") as file:
+            file.write("".join(key + "\n" for key in keys))
+        for key in keys:
+            self.rows[key] = len(self.rows)
+
+    def embed(self, docs, model=None, batch_size=64, show_progress_bar=False):
+        """
+        This function returns the embeddings of the documents, only documents that are not in the cache are encoded
+        Args:
+            docs: list of documents
+            model: SentenceTransformer, loaded (from model_name) only if documents are missing
+            batch_size: documents per batch of model.encode
+        returns:
+            float32 array, one row per document (in the order of docs)
+        """
+        keys = [text_hash(str(doc)) for doc in docs]
+        missing = {}
+        for key, doc in zip(keys, docs):
+            if key not in self.rows:
+                missing.setdefault(key, str(doc))
+
+        if missing:
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(self.model_name)
+            missing_keys = list(missing)
+            for start in range(0, len(missing_keys), ENCODE_CHUNK):
+                chunk = missing_keys[start:start + ENCODE_CHUNK]
+                vectors = model.encode([missing[key] for key in chunk], batch_size=batch_size, show_progress_bar=show_progress_bar)
+                self.add(chunk, vectors)
+
+        rows = np.fromiter((self.rows[key] for key in keys), dtype=np.int64, count=len(keys))
+        return np.asarray(self.vectors()[rows], dtype=np.float32)
+
+
+def embed_documents(docs, model_name=EMBEDDING_MODEL, folder=CACHE_FOLDER, dtype="float16", batch_size=64, show_progress_bar=False):
+    """
+    This function returns the embeddings of the documents from the cache of the embedding model (missing documents are encoded and added)
+    Args:
+        docs: list of documents, e.g. data["whole_text"].to_list()
+        model_name: name of the sentence_transformers model, use the same for BERTopic(embedding_model=model_name)
+    returns:
+        float32 array for BERTopic.fit_transform(docs, embeddings=...)
+    """
+    cache = EmbeddingCache(model_name, folder, dtype)
+    return cache.embed(docs, batch_size=batch_size, show_progress_bar=show_progress_bar)
@@ -0,0 +1,260 @@
+import pandas as pd
+import io
+import os
+import json
+import argparse
+
+import read_in_txt
+import preprocessing_BERTopic as preprocessing
+from aggregate_cube import AggregateCube, CUBE_FOLDER, KEYWORDS_FILE, load_keywords
+
+"""
+- incremental mode of read_in_txt.py and preprocessing_BERTopic.py: only new months are read, matched and cleaned. The rows are appended to
+  <subreddit>_subs_comments_final.csv and <subreddit>_clean.csv instead of building both files again from all months
+- small indexes of the data already in the csv files are kept in the folder "incremental state":
+    - <subreddit>_threads.csv: permalinks of the submissions, so comments on submissions from earlier months are kept
+    - <subreddit>_depth.csv: depth of the comments, so replies to comments from earlier months get the right depth
+    - <subreddit>_dedup.csv: key (author + text hash), category and date_time of the clean rows, for the duplicate rules of last_cleaning
+    - <subreddit>_months.json: months that are already in the csv files (dump months of the parquet partitions or txt files, not the months of
+      date_time: a dump also holds a few rows of the next month)
+- the first run with --init builds the indexes from the existing csv files (once over all data), afterwards a run only reads the new months
+    e.g. python incremental_update.py --subreddit Mommit --init
+         python incremental_update.py --subreddit Mommit --months 2022-04 2022-05
+- appended rows are sorted by permalink_short and date_time within the new months, comments on older submissions are not moved to them
+- the new clean rows are also added to the aggregate cube of the subreddit ("aggregate cube" folder, see aggregate_cube.py) if there is one
+"""
+
+STATE_FOLDER = "incremental state"
+# text columns stay strings after csv_roundtrip, also when they are empty for all new rows (e.g. a month with comments only)
+TEXT_COLUMNS = ["title", "selftext", "body", "url", "permalink", "permalink_short", "author_flair_text"]
+
+
+def state_paths(subreddit:str, state_folder=STATE_FOLDER):
+    """
+    paths of the index files of a subreddit
+    """
+    name = subreddit.lower()
+    return {
+        "threads": os.path.join(state_folder, f"{name}_threads.csv"),
+        "depth": os.path.join(state_folder, f"{name}_depth.csv"),
+        "dedup": os.path.join(state_folder, f"{name}_dedup.csv"),
+        "months": os.path.join(state_folder, f"{name}_months.json"),
+    }
+
+
+def csv_roundtrip(df:pd.DataFrame):
+    """
+    writes and reads a dataframe as csv in memory, so new rows have the same types as the full pipeline (which reads the csv files)
+    """
+    dtypes = {col: object for col in TEXT_COLUMNS if col in df.columns}
+    return pd.read_csv(io.StringIO(df.to_csv(sep=";")), sep=";", dtype=dtypes).iloc[:,1:]
+
+
+def csv_columns(df:pd.DataFrame, path, index=True):
+    """
+    orders the columns of df like the header of an existing csv file. Raises an error if the columns are not the same (e.g. a <subreddit>_clean.csv
+    of an older version of preprocessing_BERTopic.py), the rows would not fit the header
+    """
+    if not os.path.exists(path):
+        return df
+    columns = pd.read_csv(path, sep=";", nrows=0).columns.tolist()[1 if index else 0:]
+    if sorted(columns) != sorted(df.columns):
+        missing = [col for col in columns if col not in df.columns]
+        extra = [col for col in df.columns if col not in columns]
+        raise ValueError(f"{path} has other columns than the new rows (missing: {missing}, new: {extra}), build it again with the full pipeline")
+    return df[columns]
+
+
+def append_csv(df:pd.DataFrame, path, index=True):
+    """
+    appends rows to a csv file (with header if the file is new), in the column order of the file
+    """
+    df = csv_columns(df, path, index)
+    df.to_csv(path, sep=";", mode="a", header=not os.path.exists(path), index=index)
+
+
+def load_state(subreddit:str, state_folder=STATE_FOLDER):
+    """
+    loads the indexes of a subreddit
+    returns:
+        threads: set of submission permalinks
+        known_depth: series id -> depth
+        seen: dataframe with key, category and date_time of the clean rows
+        months: list of months in the csv files
+    """
+    paths = state_paths(subreddit, state_folder)
+    threads = set(pd.read_csv(paths["threads"], sep=";")["permalink_short"])
+    depth = pd.read_csv(paths["depth"], sep=";", dtype={"id": str})
+    known_depth = pd.Series(depth["depth"].to_numpy(), index=depth["id"].to_numpy())
+    known_depth = known_depth[~known_depth.index.duplicated(keep="last")]
+    seen = pd.read_csv(paths["dedup"], sep=";", parse_dates=["date_time"])
+    with open(paths["months"], "r", encoding="utf-8") as file:
+        months = json.load(file)
+    return threads, known_depth, seen, months
+
+
+def update_state(subreddit:str, matched:pd.DataFrame, clean:pd.DataFrame, months, state_folder=STATE_FOLDER):
+    """
+    appends the new rows to the indexes of a subreddit
+    Args:
+        matched: new rows of <subreddit>_subs_comments_final.csv after add_info
+        clean: new rows of <subreddit>_clean.csv
+        months: all months in the csv files (old and new)
+    """
+    os.makedirs(state_folder, exist_ok=True)
+    paths = state_paths(subreddit, state_folder)
+
+    submissions = matched[matched["category"] == "submissions"]
+    append_csv(submissions[["permalink_short"]], paths["threads"], index=False)
+    comments = matched[matched["category"] == "comments"]
+    depth = comments[["id"]].assign(depth=comments["test_hier_complete"].to_numpy()).drop_duplicates("id", keep="last")
+    if os.path.exists(paths["depth"]):
+        # the matched rows are not deduplicated yet: a comment that is in two dumps keeps its first entry
+        known = set(pd.read_csv(paths["depth"], sep=";", dtype={"id": str}, usecols=["id"])["id"])
+        depth = depth[~depth["id"].isin(known)]
+    append_csv(depth, paths["depth"], index=False)
+    append_csv(pd.DataFrame({"key": preprocessing.dedup_keys(clean), "category": clean["category"], "date_time": clean["date_time"]}), paths["dedup"], index=False)
+
+    with open(paths["months"], "w", encoding="utf-8") as file:
+        json.dump(sorted(months), file)
+
+
+def init_state(subreddit:str, state_folder=STATE_FOLDER):
+    """
+    builds the indexes of a subreddit from the existing <subreddit>_subs_comments_final.csv and <subreddit>_clean.csv (only the needed columns are read)
+    """
+    name = subreddit.lower()
+    for path in state_paths(subreddit, state_folder).values():
+        if os.path.exists(path):
+            os.remove(path)
+
+    matched = preprocessing.load_csv(f"{name}_subs_comments_final.csv", columns=["id", "parent_id", "link_id", "permalink", "category", "date_time"])
+    matched = preprocessing.add_info(matched.assign(url=""))
+    clean = preprocessing.load_csv(f"{name}_clean.csv", columns=["author", "whole_text", "category", "date_time"])
+    months = ingested_months(subreddit)
+
+    update_state(subreddit, matched, clean, months, state_folder)
+    return months
+
+
+def ingested_months(subreddit:str):
+    """
+    dump months of a subreddit that were written by data_dump_read.py (parquet partitions if there are any, else the text files)
+    """
+    parquet_path = os.path.join(os.getcwd(), "filtered parquet")
+    months = set()
+    if os.path.isdir(parquet_path):
+        for category in ["submissions", "comments"]:
+            for partition in read_in_txt.subreddit_partitions(parquet_path, subreddit, category):
+                folder = os.path.join(parquet_path, f"category={category}", f"subreddit={partition}")
+                months.update(name.split("=", 1)[1] for name in os.listdir(folder) if name.startswith("month="))
+        return sorted(months)
+
+    folder_path = os.path.join(os.getcwd(), "filtered text files")
+    for category in ["submissions", "comments"]:
+        prefix = f"{subreddit.lower()}_{category}_"
+        months.update(txt[len(prefix):-len(".txt")] for txt in os.listdir(folder_path) if txt.startswith(prefix) and txt.endswith(".txt"))
+    return sorted(months)
+
+
+def load_months(subreddit:str, months, category:str):
+    """
+    loads the submissions or comments of a subreddit for the new months (parquet files if there are any, else the text files),
+    an empty dataframe if there are none
+    """
+    parquet_path = os.path.join(os.getcwd(), "filtered parquet")
+    if os.path.isdir(parquet_path):
+        return read_in_txt.build_df_parquet(parquet_path, subreddit, category, months)
+
+    folder_path = os.path.join(os.getcwd(), "filtered text files")
+    txts = [f"{subreddit.lower()}_{category}_{month}.txt" for month in months]
+    txts = [txt for txt in txts if os.path.exists(os.path.join(folder_path, txt))]
+    if not txts:
+        return pd.DataFrame(columns=read_in_txt.SUBMISSION_COLUMNS if category == "submissions" else read_in_txt.COMMENT_COLUMNS)
+    return read_in_txt.build_df(txts, folder_path)
+
+
+def match_new(df_submissions:pd.DataFrame, df_comments:pd.DataFrame, threads):
+    """
+    matches the new comments to the new submissions (like read_in_txt.submissions_comments_match) and keeps the new comments on submissions from
+    earlier months, sorted by permalink_short and date_time
+    Args:
+        threads: set of permalinks of submissions from earlier months
+    """
+    if len(df_submissions) > 0:
+        matched = read_in_txt.submissions_comments_match(df_submissions, df_comments, df_submissions["permalink"].values.tolist())
+    else:
+        # same columns as the match (comment columns first)
+        matched = pd.concat([df_comments.iloc[:0], df_submissions.iloc[:0]])
+    old_threads = df_comments[df_comments["permalink_short"].isin(threads)]
+    old_threads = old_threads.sort_values(["permalink_short", "date_time"], kind="mergesort")
+    return pd.concat([matched, old_threads])
+
+
+def update_months(subreddit:str, months, state_folder=STATE_FOLDER, keywords_path=KEYWORDS_FILE):
+    """
+    This function reads, matches and cleans the new months of a subreddit and appends them to <subreddit>_subs_comments_final.csv and <subreddit>_clean.csv
+    Args:
+        subreddit: e.g. "Mommit"
+        months: new months like "2022-04"
+        keywords_path: keyword categories of the aggregate cube (the same as for preprocessing_BERTopic.py)
+    returns:
+        report of quality_clean and final_clean for the new rows, empty if there are no rows for the months
+    """
+    name = subreddit.lower()
+    threads, known_depth, seen, done_months = load_state(subreddit, state_folder)
+    already = sorted(set(months) & set(done_months))
+    if already:
+        raise ValueError(f"Months {already} are already in the csv files of {subreddit}")
+
+    # read_in_txt.py for the new months
+    submissions = load_months(subreddit, months, "submissions")
+    comments = load_months(subreddit, months, "comments")
+    if len(submissions) == 0 and len(comments) == 0:
+        return {}
+    df_submissions = read_in_txt.rel_submissions(submissions)
+    df_comments = read_in_txt.rel_comments(comments)
+    matched = match_new(df_submissions, df_comments, threads)
+
+    # preprocessing_BERTopic.py for the new rows
+    new_rows = preprocessing.add_info(csv_roundtrip(matched), known_depth)
+    clean, report = preprocessing.quality_clean(new_rows)
+    clean = preprocessing.title_selftext_merge(clean)
+    clean = preprocessing.clean_text_data(clean)
+    clean, final_report = preprocessing.final_clean(clean, seen)
+    report.update(final_report)
+    clean = clean.sort_values(["permalink_short", "date_time"])
+
+    # the aggregate cube of preprocessing_BERTopic.py gets the new clean rows as well
+    cube_prefix = os.path.join(CUBE_FOLDER, name)
+    cube = None
+    if AggregateCube.exists(cube_prefix):
+        cube = AggregateCube.load(cube_prefix, load_keywords(keywords_path))
+        cube.add(clean)
+
+    # both files (and the cube) are checked before anything is appended
+    matched = csv_columns(matched, f"{name}_subs_comments_final.csv")
+    clean = csv_columns(clean, f"{name}_clean.csv")
+    append_csv(matched, f"{name}_subs_comments_final.csv")
+    append_csv(clean, f"{name}_clean.csv")
+    if cube is not None:
+        cube.save(cube_prefix)
+
+    update_state(subreddit, new_rows, clean, list(done_months) + list(months), state_folder)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Append new months to the csv files of read_in_txt.py and preprocessing_BERTopic.py")
+    parser.add_argument("--subreddit", required=True, help='e.g. "Mommit" or "daddit"')
+    parser.add_argument("--months", nargs="*", default=[], help='new months like "2022-04"')
+    parser.add_argument("--init", action="store_true", help="build the indexes from the existing csv files first")
+    parser.add_argument("--keywords", default=KEYWORDS_FILE, help="json file {category: [keywords]} of the aggregate cube")
+    args = parser.parse_args()
+
+    if args.init:
+        months = init_state(args.subreddit)
+        print(f"{args.subreddit}: indexes built for {len(months)} months")
+    if args.months:
+        report = update_months(args.subreddit, args.months, keywords_path=args.keywords)
+        print(f"{args.subreddit}:", report)
@@ -0,0 +1,243 @@
+import sys
+import json
+import time
+import cProfile
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# resource is not available on windows, psutil (if installed) is used there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+"""
+- instrumentation shared by data_dump_read.py, read_in_txt.py and preprocessing_BERTopic.py
+- Run: timer of the stages of one run of a script. Each stage records its time, rows in and out (dropped rows), bytes and MB/s, rows/s and
+  the RSS high-water mark of the process. Stages with the same name (e.g. one per chunk) are summed up. At the end the run can be written as
+  json trace (with notes like the row reports of the cleaning) and profiled with cProfile (python -m pstats <file>)
+- Progress: progress line for long loops over a file: lines/s, MB/s of the compressed input and an ETA from the compressed bytes read
+"""
+
+log = logging.getLogger("pipeline")
+log.setLevel(logging.DEBUG)
+log.addHandler(logging.StreamHandler())
+
+
+def rss_high_water_mb():
+    """
+    highest resident memory of the process so far in MB, None if it can not be measured
+    """
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes on linux
+        return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20
+    except (ImportError, AttributeError):
+        return None
+
+
+def format_seconds(seconds):
+    """
+    seconds as h:mm:ss
+    """
+    if seconds is None:
+        return "-"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def result_rows(result):
+    """
+    rows of the result of a step: len of the dataframe (first element if the step returns a tuple like quality_clean), None if unknown
+    """
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+class Run:
+    """
+    This class records the stages of one run of a script.
+    Args:
+        name: name of the run, e.g. "preprocessing_BERTopic"
+        trace_path: json file for the trace of the run, None for no trace
+        profile_path: file for the cProfile stats of the run, None for no profiling
+        logger: logger for the stage lines, None for no output
+    """
+
+    def __init__(self, name:str, trace_path=None, profile_path=None, logger=log):
+        self.name = name
+        self.trace_path = trace_path
+        self.profile_path = profile_path
+        self.logger = logger
+        self.stages = {}
+        self.notes = {}
+        self.started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.begin = time.perf_counter()
+        self.profiler = None
+        if profile_path is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def stage(self, name:str, rows_in=None, bytes_in=None):
+        """
+        times the code in the with block as a stage. rows_out (and bytes, rows_in) can be set in the yielded dictionary
+            e.g. with run.stage("read", bytes_in=size) as record:
+                     ...
+                     record["rows_out"] = lines
+        """
+        record = {"rows_in": rows_in, "rows_out": None, "bytes": bytes_in}
+        begin = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.add(name, time.perf_counter() - begin, record)
+
+    def step(self, name:str, func, df, *args, **kwargs):
+        """
+        runs func(df, *args, **kwargs) as a stage, rows in and out are the lengths of df and of the result
+        """
+        with self.stage(name, rows_in=len(df)) as record:
+            result = func(df, *args, **kwargs)
+            record["rows_out"] = result_rows(result)
+        return result
+
+    def add(self, name:str, seconds:float, record:dict):
+        """
+        adds a finished stage to the run (stages with the same name are summed up)
+        """
+        total = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "rows_in": None, "rows_out": None, "bytes": None})
+        total["calls"] += 1
+        total["seconds"] += seconds
+        for key in ["rows_in", "rows_out", "bytes"]:
+            if record.get(key) is not None:
+                total[key] = (total[key] or 0) + record[key]
+        total["rss_high_water_mb"] = rss_high_water_mb()
+
+        if self.logger is not None:
+            self.logger.info(f"{self.name} : {name} : {self.stage_line(seconds, record)}")
+
+    @staticmethod
+    def stage_line(seconds:float, record:dict):
+        """
+        one line with time, rows, throughput and memory of a stage
+        """
+        parts = [format_seconds(seconds) if seconds >= 60 else f"{seconds:.2f} s"]
+        rows_in, rows_out = record.get("rows_in"), record.get("rows_out")
+        if rows_in is not None and rows_out is not None:
+            parts.append(f"{rows_in:,} -> {rows_out:,} rows ({rows_in - rows_out:,} dropped)")
+        elif rows_in is not None:
+            parts.append(f"{rows_in:,} rows")
+        if rows_in and seconds > 0:
+            parts.append(f"{rows_in / seconds:,.0f} rows/s")
+        if record.get("bytes") and seconds > 0:
+            parts.append(f"{record['bytes'] / 2**20 / seconds:.1f} MB/s")
+        rss = rss_high_water_mb()
+        if rss is not None:
+            parts.append(f"RSS max {rss:,.0f} MB")
+        return " : ".join(parts)
+
+    def note(self, key:str, value):
+        """
+        adds a value (e.g. the row report of the cleaning) to the trace
+        """
+        self.notes[key] = value
+
+    def trace(self):
+        """
+        the run as dictionary: stages with seconds, rows in/out, dropped rows, rows/s, MB/s and the RSS high-water mark, plus the notes
+        """
+        stages = []
+        for name, total in self.stages.items():
+            stage = {"stage": name, **total}
+            if total["rows_in"] is not None and total["rows_out"] is not None:
+                stage["dropped"] = total["rows_in"] - total["rows_out"]
+            stage["rows_per_s"] = round(total["rows_in"] / total["seconds"]) if total["rows_in"] and total["seconds"] > 0 else None
+            stage["mb_per_s"] = round(total["bytes"] / 2**20 / total["seconds"], 2) if total["bytes"] and total["seconds"] > 0 else None
+            stage["seconds"] = round(total["seconds"], 4)
+            stages.append(stage)
+        return {
+            "run": self.name,
+            "started": self.started,
+            "seconds": round(time.perf_counter() - self.begin, 4),
+            "rss_high_water_mb": rss_high_water_mb(),
+            "argv": sys.argv,
+            "stages": stages,
+            "notes": self.notes,
+        }
+
+    def close(self):
+        """
+        stops the profiler and writes the trace and the profile
+        """
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            self.profiler = None
+        trace = self.trace()
+        if self.trace_path is not None:
+            with open(self.trace_path, "w", encoding="utf-8") as file:
+                json.dump(trace, file, indent=2, default=str)
+        if self.logger is not None:
+            self.logger.info(f"{self.name} : finished in {format_seconds(trace['seconds'])} : RSS max {trace['rss_high_water_mb'] or 0:,.0f} MB")
+
+
+class Progress:
+    """
+    This class writes progress lines for a long loop over a (compressed) file.
+    Args:
+        name: name of the file
+        total_bytes: size of the file
+        start_bytes: bytes already read before (e.g. on resume), they do not count for the speed
+        start_lines: lines already read before
+        logger: logger for the progress lines
+    """
+
+    def __init__(self, name:str, total_bytes:int, start_bytes:int=0, start_lines:int=0, logger=log):
+        self.name = name
+        self.total_bytes = total_bytes
+        self.start_bytes = start_bytes
+        self.start_lines = start_lines
+        self.logger = logger
+        self.begin = time.perf_counter()
+
+    def line(self, lines:int, bytes_read:int, note:str=""):
+        """
+        progress line: lines, share of the file, lines/s, MB/s of the file, ETA and the RSS high-water mark
+        """
+        seconds = time.perf_counter() - self.begin
+        done = bytes_read - self.start_bytes
+        eta = seconds * (self.total_bytes - bytes_read) / done if done > 0 else None
+        parts = [self.name] + ([note] if note else []) + [
+            f"{lines:,} lines",
+            f"{bytes_read / self.total_bytes * 100 if self.total_bytes else 100:.0f}%",
+            f"{(lines - self.start_lines) / seconds if seconds > 0 else 0:,.0f} lines/s",
+            f"{done / 2**20 / seconds if seconds > 0 else 0:.1f} MB/s",
+            f"ETA {format_seconds(eta)}",
+        ]
+        rss = rss_high_water_mb()
+        if rss is not None:
+            parts.append(f"RSS max {rss:,.0f} MB")
+        return " : ".join(parts)
+
+    def update(self, lines:int, bytes_read:int, note:str=""):
+        """
+        writes the progress line
+        """
+        if self.logger is not None:
+            self.logger.info(self.line(lines, bytes_read, note))
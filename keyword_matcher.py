@@ -0,0 +1,127 @@
+import re
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+"""
+- matcher for the keyword lists on home responsibilities (posts_traditional_roles.ipynb, topics_traditional_roles.ipynb)
+- all keywords are combined into one regular expression (a trie of the keywords), so each document is scanned once instead of once per keyword
+- a keyword is found with the same rule as re.search(r'\bkeyword\b', text): only EXACT keywords, as whole words. Matching is case sensitive,
+  lowercase the texts before for case insensitive matching
+- result is a sparse hit matrix (documents x keywords), the chores filter and the label counts are derived from it
+"""
+
+# zero width match at a word boundary
+WORD_BOUNDARY = re.compile(r"\b")
+
+
+def trie_regex(keywords):
+    """
+    builds one regular expression for all keywords from a trie. Keywords with the same beginning share it, so at each position of a text
+    only the characters are compared that can still lead to a keyword. The optional parts are greedy: the longest keyword is tried first.
+    Args:
+        keywords: list of keywords
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {} # end of a keyword
+
+    def node_regex(node):
+        alternatives = [re.escape(char) + node_regex(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        body = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+        return "(?:" + body + ")?" if "" in node else body
+
+    return node_regex(trie)
+
+
+class KeywordMatcher:
+    """
+    This class matches keywords against documents in one scan per document.
+    Args:
+        keywords: list of keywords or dictionary {category: list of keywords}
+    """
+
+    def __init__(self, keywords):
+        if isinstance(keywords, dict):
+            self.categories = list(keywords)
+            pairs = [(category, keyword) for category, category_keywords in keywords.items() for keyword in category_keywords]
+        else:
+            self.categories = []
+            pairs = [(None, keyword) for keyword in keywords]
+
+        # each keyword once, in order of the input
+        self.keywords = list(dict.fromkeys(keyword for _, keyword in pairs))
+        self.column = {keyword: i for i, keyword in enumerate(self.keywords)}
+
+        # keywords x categories: how often a keyword is listed for a category (a keyword listed twice counts twice, like in assign_label)
+        category_index = {category: i for i, category in enumerate(self.categories)}
+        rows = [self.column[keyword] for category, keyword in pairs if category is not None]
+        cols = [category_index[category] for category, keyword in pairs if category is not None]
+        self.keyword_categories = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(len(self.keywords), len(self.categories))
+        )
+
+        # at every position the lookahead finds the longest keyword that ends at a word boundary
+        self.pattern = re.compile(r"(?=\b(" + trie_regex(self.keywords) + r")\b)")
+        # shorter keywords that can be found at the same position (the beginning of a longer keyword, e.g. "lunch" in "lunch box")
+        self.prefixes = {
+            keyword: [(len(other), self.column[other]) for other in self.keywords if other != keyword and keyword.startswith(other)]
+            for keyword in self.keywords
+        }
+
+    def find(self, text):
+        """
+        returns the set of columns (keyword positions in self.keywords) of all keywords found in text
+        """
+        found = set()
+        if not isinstance(text, str):
+            return found
+        for match in self.pattern.finditer(text):
+            keyword = match.group(1)
+            found.add(self.column[keyword])
+            start = match.start()
+            for length, column in self.prefixes[keyword]:
+                if WORD_BOUNDARY.match(text, start + length):
+                    found.add(column)
+        return found
+
+    def hit_matrix(self, texts):
+        """
+        This function scans every document once
+        Args:
+            texts: documents (list or pd.Series), documents that are not strings have no hits
+        returns:
+            sparse matrix documents x keywords, 1 if the keyword is found in the document
+        """
+        indptr = [0]
+        indices = []
+        for text in texts:
+            indices.extend(sorted(self.find(text)))
+            indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int8), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+            shape=(len(indptr) - 1, len(self.keywords)),
+        )
+
+    def any_hit(self, hits):
+        """
+        boolean array: at least one keyword is found in the document
+        """
+        return np.diff(hits.indptr) > 0
+
+    def keyword_counts(self, hits):
+        """
+        number of documents each keyword is found in
+        """
+        return pd.Series(np.asarray(hits.sum(axis=0)).ravel(), index=self.keywords)
+
+    def category_counts(self, hits):
+        """
+        documents x categories: number of keywords of the category found in the document
+        """
+        return np.asarray((hits.astype(np.int64) @ self.keyword_categories).todense())
@@ -1,12 +1,55 @@
 import pandas as pd
-from langdetect import detect
-from datetime import datetime, timedelta
+from langdetect import detect, DetectorFactory
 import numpy as np
+import os
+import json
+import zlib
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from read_in_txt import thread_permalink
+from instrumentation import Run
+from text_keys import text_hash
+from aggregate_cube import AggregateCube, CUBE_FOLDER, KEYWORDS_FILE, load_keywords
 
 """
 Data cleaning
 """
 
+# body of comments that were removed by a moderator or deleted by the author
+REMOVED_MARKERS = ["[removed]", "[deleted]"]
+
+def quality_clean(df_orig:pd.DataFrame()):
+    """
+    This function checks the original dataframe and removes deleted and removed comments in one go. All masks and counts are computed together,
+    no intermediate dataframes are built.
+    Args: original dataframe (mommit or daddit)
+    returns:
+        clean_df: df without deleted or removed comments
+        report: dictionary with the counts of
+            - rows: rows in the original df
+            - duplicates: duplicated rows
+            - deleted_submissions: submissions where selftext & title were later on deleted
+            - removed_selftext: submissions where the moderator removed the selftext
+            - dropped_comments: deleted or removed comments (dropped)
+            - rows_clean: rows in clean_df
+    """
+    dropped_comments = df_orig["body"].isin(REMOVED_MARKERS).to_numpy()
+    removed_selftext = (df_orig["selftext"] == "[removed]").to_numpy()
+    deleted_submissions = ((df_orig["selftext"] == "[deleted]") & (df_orig["title"] == "[deleted]")).to_numpy()
+
+    report = {
+        "rows": len(df_orig),
+        "duplicates": int(df_orig.duplicated().sum()),
+        "deleted_submissions": int(deleted_submissions.sum()),
+        "removed_selftext": int(removed_selftext.sum()),
+        "dropped_comments": int(dropped_comments.sum()),
+        "rows_clean": int(len(df_orig) - dropped_comments.sum()),
+    }
+    clean_df = df_orig[~dropped_comments]
+
+    return clean_df, report
+
 def data_quality_check(df_orig:pd.DataFrame()):
     """"
     This function tests the original dataframe:
@@ -14,29 +57,22 @@ def data_quality_check(df_orig:pd.DataFrame()):
         - checks submissions for cases where selftext & title were later on deleted
         - checks for removed comments
         - checks for deleted or removed comments
+    returns: clean df without deleted or removed comments (see quality_clean)
     """
-    # check for duplicates
-    duplicates = df_orig[df_orig.duplicated()]
-    if len(duplicates)>0:
+    clean_df, report = quality_clean(df_orig)
+
+    if report["duplicates"]>0:
         print("Attention: Duplicates in dataframe")
 
     # check for submissions with deleted selftext & title (if only selftext is deleted but title remains the post is still online)
-    deleted_submissions= df_orig[(df_orig["selftext"]=="[deleted]") & (df_orig["title"]=="[deleted]")] # empty dataframe
-    if len(deleted_submissions)>0:
+    if report["deleted_submissions"]>0:
         print("Attention: deleted selftext & title") # drop them
 
     # removed by moderator -> selftext says [removed]
-    removed_selftext=df_orig[df_orig["selftext"]=="[removed]"]
-    if len(removed_selftext)>0:
+    if report["removed_selftext"]>0:
         print("Attention: the moderator removed submission(s). Decide how to handle these cases, as the title is still there")
 
-    # removed or deleted comments (no other information left --> drop later)
-    comments_to_drop= df_orig[(df_orig["body"] == "[removed]") | (df_orig["body"] == "[deleted]")]
-
-    if len(comments_to_drop)>0:
-        drop_comments=clean_comments(df_orig)
-
-    return drop_comments
+    return clean_df
 
 def clean_comments(df_orig:pd.DataFrame()):
     """
@@ -44,22 +80,118 @@ def clean_comments(df_orig:pd.DataFrame()):
     Args: original dataframe (mommit or daddit)
     returns: clean df without deleted or removed comments
     """
-    df_drop=df_orig[(df_orig["body"] == "[removed]") | (df_orig["body"] == "[deleted]")]
+    clean_df = df_orig[~df_orig["body"].isin(REMOVED_MARKERS)]
 
-    # merge the dataframe with rows to be dropped and the original dataframe
-    merged = pd.merge(df_orig, df_drop, how='left', indicator=True)
+    return clean_df
 
-    # create dataframe that contains the rows to be removed (that are in the original and the dropped df)
-    removed_rows = merged[merged['_merge'] == 'both']
-    
-    # create a boolean mask for the rows to be removed
-    removed_mask = df_orig.isin(removed_rows.to_dict('list')).all(axis=1)
-    
-    # use  boolean mask to remove the rows from df_orig
-    clean_df = df_orig[~removed_mask]
 
-    return clean_df
+# types of the columns in the csv files of read_in_txt.py and preprocessing_BERTopic.py, the other columns are read as text. Columns with few
+# different values are categoricals, ids stay strings (an id of only digits would otherwise become a number)
+CSV_DTYPES = {
+    "subreddit": "category",
+    "category": "category",
+    "author": "category",
+    "created_utc": "int64",
+    "num_comments": "float32",
+    "test_hier_complete": "int16",
+    "image": "int8",
+    "id": str,
+    "parent_id": str,
+    "link_id": str,
+    "parent_id_short": str,
+    "thread_id": str,
+}
+CATEGORICAL_COLUMNS = [col for col, dtype in CSV_DTYPES.items() if dtype == "category"]
+# rows per chunk of clean_csv
+CHUNK_ROWS = 200000
+
+def add_date_time(df:pd.DataFrame):
+    """
+    parses date_time once: from created_utc (int seconds, fast) if the column is there, else from the text
+    """
+    if "created_utc" in df:
+        df["date_time"] = pd.to_datetime(df["created_utc"], unit="s")
+    elif "date_time" in df:
+        df["date_time"] = pd.to_datetime(df["date_time"])
+    return df
+
+def load_csv(csv:str, columns=None, chunksize=None, dtypes=CSV_DTYPES):
+    """
+    This function reads a csv file of read_in_txt.py or preprocessing_BERTopic.py (sep ";") with explicit column types instead of
+    pd.read_csv(csv, sep=";").iloc[:,1:]
+        - the index column is not read
+        - subreddit, category and author are categoricals, created_utc is an integer, date_time is parsed once (datetime)
+    Args:
+        csv: path of the csv file
+        columns: list of columns to read, None for all
+        chunksize: number of rows per chunk, None to read the whole file
+        dtypes: column types
+    returns:
+        dataframe, or an iterator of dataframes if chunksize is given
+    """
+    usecols = (lambda col: col in columns) if columns is not None else (lambda col: col != "Unnamed: 0")
+    reader = pd.read_csv(csv, sep=";", usecols=usecols, dtype=dtypes, chunksize=chunksize)
+    if chunksize is None:
+        return add_date_time(reader)
+    return (add_date_time(chunk) for chunk in reader)
+
+def thread_chunks(chunks):
+    """
+    This function regroups chunks of a csv file so that the rows of a thread (permalink_short) are never split between two chunks: the
+    rows of the last thread of a chunk are moved to the next chunk. The csv files of read_in_txt.py are ordered by thread, but after
+    incremental_update.py the comments on older threads are appended at the end of the file: these threads are split between chunks, the
+    depth and the duplicate rules of the later chunks are still right because clean_csv passes known_depth and seen on.
+    Older csv files without permalink_short are grouped by the thread of the permalink (like add_info), the column is left to add_info.
+    """
+    rest = None
+    for chunk in chunks:
+        if rest is not None:
+            chunk = pd.concat([rest, chunk])
+            # categories of different chunks differ, the concatenated columns are objects again
+            for col in CATEGORICAL_COLUMNS:
+                if col in chunk:
+                    chunk[col] = chunk[col].astype("category")
+        if "permalink_short" in chunk:
+            threads = chunk["permalink_short"].to_numpy()
+        else:
+            threads = np.where(chunk["category"] == "comments", thread_permalink(chunk["permalink"]), chunk["permalink"]).astype(object)
+        other_threads = np.flatnonzero(threads != threads[-1])
+        split = other_threads[-1] + 1 if len(other_threads) else 0
+        if split == 0:
+            rest = chunk
+            continue
+        yield chunk.iloc[:split]
+        rest = chunk.iloc[split:]
+    if rest is not None:
+        yield rest
+
+def month_bounds(year:int, month:int):
+    """
+    start of the month and start of the next month
+    """
+    start = pd.Timestamp(year=year, month=month, day=1)
+    return start, start + pd.offsets.MonthBegin(1)
 
+def sort_by_time(df_orig:pd.DataFrame()):
+    """
+    sorts a dataframe by date_time (stable) and adds date_time_dt, so get_month and get_month_submissions slice the month by binary search
+    instead of comparing every row
+    """
+    df_sorted = df_orig.assign(date_time_dt=pd.to_datetime(df_orig["date_time"]))
+    return df_sorted.sort_values("date_time_dt", kind="mergesort")
+
+def month_rows(df_orig:pd.DataFrame(), year:int, month:int):
+    """
+    rows of a month. date_time_dt is added once (later calls reuse it), a dataframe sorted by time (see sort_by_time) is sliced by binary search
+    """
+    if "date_time_dt" not in df_orig:
+        df_orig["date_time_dt"] = pd.to_datetime(df_orig["date_time"])
+    start_date, end_date = month_bounds(year, month)
+    times = df_orig["date_time_dt"]
+    if times.is_monotonic_increasing:
+        start, end = times.searchsorted([start_date, end_date])
+        return df_orig.iloc[start:end]
+    return df_orig[(times >= start_date) & (times < end_date)]
 
 def get_month_submissions(df_orig:pd.DataFrame(), year:int, month:int):
     """
@@ -72,16 +204,9 @@ def get_month_submissions(df_orig:pd.DataFrame(), year:int, month:int):
         df_month: dataframe filtered to month and year of interest
     
     """
-    # create timestamps for start and end of the month of interest
-    start_date = datetime(year=year, month=month, day=1)
-    end_date = start_date + timedelta(days=pd.Period(start_date, freq='M').days_in_month-1, hours=23, minutes=59, seconds=59)
-    
-    # create date_time object and filter for submissions
-    df_orig["date_time_dt"]= pd.to_datetime(df_orig['date_time'])
-    submissions = df_orig[df_orig['category'] == 'submissions']
-
-    # filter for time period of interst
-    df_month = submissions[(submissions['date_time_dt'] >= start_date) & (submissions['date_time_dt'] <= end_date)]
+    # filter for time period of interest, then for submissions
+    df_month = month_rows(df_orig, year, month)
+    df_month = df_month[df_month['category'] == 'submissions']
     
     return df_month
 
@@ -90,17 +215,21 @@ def get_month(df_orig:pd.DataFrame(), year: int, month:int):
     This function creates a dataframe for a respective month of interest from an input dataframe (mommit or daddit) for submissions & comments
 
     """
-    # create timestamps for start and end of the month of interest
-    start_date = datetime(year=year, month=month, day=1)
-    end_date = start_date + timedelta(days=pd.Period(start_date, freq='M').days_in_month-1, hours=23, minutes=59, seconds=59)
-    
-    df_orig["date_time_dt"]= pd.to_datetime(df_orig['date_time'])
-    
     # filter for time period of interest
-    df_month_whole_df = df_orig[(df_orig['date_time_dt'] >= start_date) & (df_orig['date_time_dt'] <= end_date)]
+    df_month_whole_df = month_rows(df_orig, year, month)
     
     return df_month_whole_df
 
+# langdetect is random without a fixed seed
+DetectorFactory.seed = 0
+
+# value for texts that are not detected with skip_ascii: pure ASCII texts are written in a latin script language (never one of
+# the invalid languages in clean_text_data). It is not a language code, so the pipeline detects all titles for the language
+# column
+ASCII_LANGUAGE = "ascii"
+# texts per batch that one worker process detects
+LANGUAGE_BATCH_SIZE = 2000
+
 def detect_language(text):
     """
     function that detects the language of a text
@@ -111,15 +240,83 @@ def detect_language(text):
         lang = 'unknown'
     return lang
 
+def detect_language_batch(texts):
+    """
+    detects the language of a list of texts (job for one worker process)
+    """
+    DetectorFactory.seed = 0
+    return [detect_language(text) for text in texts]
 
-def title_selftext_merge(df_orig):
+def detect_languages(texts:pd.Series, cache_path=None, workers=None, skip_ascii=False):
+    """
+    This function detects the language of many texts at once
+        - missing texts get 'unknown', pure ASCII texts get ASCII_LANGUAGE without detection (skip_ascii), all other texts get the same language
+          as detect_language
+        - the language of a text is looked up in a cache (json file: sha1 of the text -> language), so unchanged texts are never detected twice
+        - the other texts are detected in batches by a pool of worker processes and added to the cache
+    Args:
+        texts: texts to detect the language of
+        cache_path: json file of the cache, None for no cache
+        workers: number of worker processes, None for one per cpu
+        skip_ascii: don't detect pure ASCII texts (only to filter for non latin languages, the result is not a language code for them)
+    returns:
+        languages with the index of texts
+    """
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as file:
+            cache = json.load(file)
+
+    # by position, the index of texts can have duplicated labels (e.g. the position within the thread of submissions_comments_match)
+    values = texts.to_numpy()
+    languages = [None] * len(values)
+    keys = [None] * len(values)
+    missing = {}
+    for i, text in enumerate(values):
+        if not isinstance(text, str):
+            languages[i] = 'unknown'
+        elif skip_ascii and text.isascii():
+            languages[i] = ASCII_LANGUAGE
+        else:
+            keys[i] = text_hash(text)
+            if keys[i] not in cache:
+                missing.setdefault(keys[i], text)
+
+    # detect each missing text once, even if it occurs several times
+    missing_keys = list(missing)
+    batches = [[missing[key] for key in missing_keys[i:i + LANGUAGE_BATCH_SIZE]] for i in range(0, len(missing_keys), LANGUAGE_BATCH_SIZE)]
+    if len(batches) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            detected = [lang for batch in executor.map(detect_language_batch, batches) for lang in batch]
+    else:
+        detected = [lang for batch in batches for lang in detect_language_batch(batch)]
+    cache.update(zip(missing_keys, detected))
+
+    if cache_path is not None and missing_keys:
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(cache, file)
+        os.replace(tmp_path, cache_path)
+
+    for i, key in enumerate(keys):
+        if key is not None:
+            languages[i] = cache[key]
+
+    return pd.Series(languages, index=texts.index, dtype=object)
+
+
+def title_selftext_merge(df_orig, cache_path="language_cache.json", workers=None):
     """
     This function combines the selfext and title columns into one
+    Args:
+        df_orig: mommit or daddit df
+        cache_path: json file with already detected languages (see detect_languages)
+        workers: number of worker processes for the language detection, None for one per cpu
     """
-    df_orig["whole_text"] = df_orig.apply(lambda x: x["title"] + "\n" + x["selftext"] if not pd.isna(x["title"]) and not pd.isna(x["selftext"]) else x["title"] if not pd.isna(x["title"]) else x["selftext"], axis=1)
+    df_orig["whole_text"] = df_orig.apply(lambda x: x["title"] + "\n" + x["selftext"] if not pd.isna(x["title"]) and not pd.isna(x["selftext"]) else x["title"] if not pd.isna(x["title"]) else x["selftext"], axis=1).astype(object) # object also if there are only comments (no title)
     
     # add detected language for each row
-    df_orig['language'] = df_orig['title'].apply(detect_language)
+    df_orig['language'] = detect_languages(df_orig['title'], cache_path, workers)
 
     return df_orig #submissions
 
@@ -140,63 +337,97 @@ def clean_text_data(df_orig:pd.DataFrame):
 
     return clean_df
 
-def hierarchy_label(df:pd.DataFrame(), level:int):
+def comment_depth(df:pd.DataFrame(), known_depth:pd.Series=None):
     """
-    - The function is structured in 3 parts
-    1) First i create a short version of the parent id that cuts the first 3 characters of the values.
-    2) Then i create a variable hier1 which states that the comment is a direct response to a submission. In that cases, parent_id == link id. 
-    3) Then for all other hierarchy levels, another logic is applied. Exemple of hierarchy 2 (reply to comment that was posted directly under submission):
-        the loop gets all ids for the rows where hier1==1 and saves it in search_value. For all rows that are of hier2, the id from rows with hier1 is equal
-        to parent_id_short. The loop starts with hier2 and ends with the level inputted e.g. 10
-    
+    This function finds the depth of every comment in its thread (1 = reply to the submission, 2 = reply to such a comment, ...).
+    Every comment is mapped once to the row of its parent comment. Then the chains of parents are followed by pointer jumping: in each step
+    every row jumps to the parent of its parent and adds up the distances, so a depth of d needs only log2(d) vectorized steps and there is no maximum depth.
+
     Args:
         df: mommit and daddit df
-        level: how many levels should be found 
+        known_depth: depth of comments that are not in df (id -> depth), e.g. from earlier months in the incremental mode
+    returns:
+        depth: numpy array, 0 for submissions and for comments whose chain of parents up to the submission is not complete in df
+        parent_row: numpy array with the row position of the parent (comment or submission) in df, -1 if the parent is not in df
     """
+    # row position of every id (first row if an id occurs more than once)
+    row_of_id = pd.Series(np.arange(len(df)), index=df["id"].astype(str).to_numpy())
+    row_of_id = row_of_id[~row_of_id.index.duplicated()]
+
+    parent_id = df["parent_id"]
+    parent_row = row_of_id.reindex(parent_id.str[3:].to_numpy()).fillna(-1).to_numpy(dtype=np.int64)
+
+    # ancestor of each row: -1 = submission reached, -2 = chain broken (submissions, parent missing); distance to that ancestor
+    top_level = (parent_id == df["link_id"]).to_numpy()
+    reply = (parent_id.str.startswith("t1_") & (parent_row >= 0)).to_numpy()
+    ancestor = np.where(top_level, -1, np.where(reply, parent_row, -2))
+    distance = np.ones(len(df), dtype=np.int64)
+
+    # replies to comments with a known depth outside of df end there
+    if known_depth is not None:
+        parent_depth = known_depth.reindex(parent_id.str[3:].to_numpy()).fillna(0).to_numpy(dtype=np.int64)
+        outside = (ancestor == -2) & parent_id.str.startswith("t1_").to_numpy() & (parent_depth > 0)
+        ancestor[outside] = -1
+        distance[outside] = parent_depth[outside] + 1
+
+    for _ in range(64):
+        rows = np.flatnonzero(ancestor >= 0)
+        if len(rows) == 0:
+            break
+        up = ancestor[rows]
+        distance[rows] += distance[up]
+        ancestor[rows] = ancestor[up]
+    else:
+        # chains that are still open after 2**64 steps are cycles
+        ancestor[ancestor >= 0] = -2
+
+    depth = np.where(ancestor == -1, distance, 0)
+    return depth, parent_row
+
+
+def hierarchy_label(df:pd.DataFrame(), parent_row:bool=False, known_depth:pd.Series=None):
+    """
+    - The function adds the position of each submission/comment in its thread
+    1) test_hier_complete: depth of the comment, see comment_depth. E.g. 1 = comment was posted directly under the submission, 2 = reply to a comment with 1.
+        0 for submissions and for comments where a parent is missing in df
+    2) thread_id: id of the submission the row belongs to (link_id without t3_ for comments, id for submissions)
+    3) parent_row (optional): row position (not index label) of the parent comment/submission in df, -1 if the parent is not in df
 
-    df["parent_id"] = df["parent_id"].astype(str)
-    df["parent_id_short"]= df["parent_id"].apply(lambda x: x[3:] if not pd.isna(x) else x)
-
-    # level=level --> müsste raus können
-    df["hier1"]=np.where(df["parent_id"] == df["link_id"], 1, 0)
-
-    for i in range(2, level):
-        # Get id column for cases where comment hierarchy == i-1
-        search_value = df.query(f"hier{i-1}=={i-1}")["id"]
-        search_value = [str(x) for x in search_value.tolist()]
+    Args:
+        df: mommit and daddit df
+        parent_row: whether to add the parent_row column
+        known_depth: depth of comments that are not in df (id -> depth), see comment_depth
+    """
+    depth, parent_rows = comment_depth(df, known_depth)
 
-        # Create hierarchy column for level i
-        df[f"hier{i}"] = np.where(df["parent_id_short"].isin(search_value), i, 0)
+    df["parent_id_short"]= df["parent_id"].str[3:]
+    df["test_hier_complete"] = depth
+    df["thread_id"] = df["link_id"].str[3:].fillna(df["id"])
+    if parent_row:
+        df["parent_row"] = parent_rows
 
     return df
 
 
-def add_info(df:pd.DataFrame()):
+def add_info(df:pd.DataFrame(), known_depth:pd.Series=None):
     """
     This function is designed to add further information to the dataframe. 
 
     Args:
         df = original data
+        known_depth = depth of comments from earlier months (id -> depth), only for the incremental mode
     
     """
-    # apply hierarchy label function
-    clean_df_test=hierarchy_label(df, 16) # bis zum 15. level
-
-    # add all hier columns to one complete columns
-    hier_cols=[col for col in clean_df_test.columns if col.startswith("hier")]
-    clean_df_test["test_hier_complete"]= clean_df_test[hier_cols].sum(axis=1)
-    clean_df_test['test_hier_complete'].astype(int)
+    # apply hierarchy label function (depth of the comments in the column test_hier_complete)
+    clean_df_test=hierarchy_label(df, known_depth=known_depth)
 
     # create a column "entity" that groups together one submission with its corresponding comments. To be able to group one entity use permalink
-    # if category == comment, delete last /.../
-    for idx, row in clean_df_test.iterrows():
-        if row["category"] == "comments":
-            permalink_parts = row["permalink"].split("/")
-            permalink_parts[-2] = ""
-            permalink_parts = [part for part in permalink_parts if part != ""]
-            clean_df_test.at[idx, "permalink_short"] = "/"+ "/".join(permalink_parts) + "/"
-        elif row["category"] == "submissions":
-            clean_df_test.at[idx, "permalink_short"] = row["permalink"]
+    # if category == comment, delete last /.../ (read_in_txt.py already adds the column, only older csv files need it here)
+    if "permalink_short" not in clean_df_test:
+        clean_df_test["permalink_short"] = np.where(
+            clean_df_test["category"] == "comments", thread_permalink(clean_df_test["permalink"]),
+            np.where(clean_df_test["category"] == "submissions", clean_df_test["permalink"], np.nan)
+        )
     
     # Image in submission yes or no
     clean_df_test['image'] = np.where((clean_df_test['url'].notna() & clean_df_test['url'].str.endswith('.jpg')), 1, 0)
@@ -204,21 +435,181 @@ def add_info(df:pd.DataFrame()):
     return clean_df_test
 
 
-def last_cleaning(df:pd.DataFrame):
-    # clean dataframes with duplicated texts (sometimes the same things by the same authors are posted several times)
-    
-    # Split the dataframe into submissions and comments
-    submissions_df = df.loc[df['category'] == 'submissions']
-    comments_df = df.loc[df['category'] == 'comments']
+# posts of the same author with the same text within this time are reposts (bots), the first one is kept
+REPOST_WINDOW = pd.Timedelta('5 min')
+# near duplicates (optional): minhash of the word SHINGLE_WORDS-grams with MINHASH_PERMUTATIONS hash functions. Candidates share all values of
+# one of MINHASH_BANDS bands, they are near duplicates if at least NEAR_DUPLICATE_SIMILARITY of the values are equal (estimated jaccard similarity)
+SHINGLE_WORDS = 3
+MINHASH_PERMUTATIONS = 32
+MINHASH_BANDS = 8
+NEAR_DUPLICATE_SIMILARITY = 0.8
+# prime > 2**32 for the hash functions (a * x + b) % MINHASH_PRIME
+MINHASH_PRIME = 4294967311
+# texts per batch of minhash_signatures (the words of a batch are in memory at once)
+MINHASH_BATCH_SIZE = 100000
+
+def dedup_keys(df:pd.DataFrame):
+    """
+    key for the duplicate rules: author and hash of whole_text (reddit user names have no ":")
+    """
+    return df["author"].astype(str) + ":" + df["whole_text"].astype(str).map(text_hash)
 
-    # Apply drop_duplicates to the submissions_df only
-    submissions_df = submissions_df.drop_duplicates(subset=['whole_text', 'author']).reset_index(drop=True)
 
-    # drop comments with less than 10 words: to be sure to grasp relevant info and not sth like "Awww thank you"
-    comments_df= comments_df[comments_df["body"].apply(lambda x: len(x.split())) >=10] 
+def group_codes(df:pd.DataFrame, columns):
+    """
+    integer code per row, equal for rows with equal values in the columns (vectorized 64 bit hash of the values)
+    """
+    return pd.factorize(pd.util.hash_pandas_object(df[columns], index=False).to_numpy())[0]
+
+
+def repost_rows(codes:np.ndarray, times:np.ndarray, window=REPOST_WINDOW):
+    """
+    This function finds reposts: rows posted at most window after the previous row of the same group. The rows are sorted by group and time
+    once, so every row is only compared to its predecessor in its own group. The first row of a burst is kept.
+    Args:
+        codes: group of each row (e.g. author and text, see group_codes)
+        times: datetime64 array
+    returns:
+        boolean array, True for reposts
+    """
+    times = times.astype("datetime64[ns]").view(np.int64)
+    order = np.lexsort((times, codes))
+    same_group = codes[order][1:] == codes[order][:-1]
+    close = np.diff(times[order]) <= window.value
+
+    repost = np.zeros(len(codes), dtype=bool)
+    repost[order[1:]] = same_group & close
+    return repost
+
+
+def minhash_signatures(texts):
+    """
+    minhash signatures (rows x MINHASH_PERMUTATIONS) of the lower case word SHINGLE_WORDS-grams of the texts. Every word is hashed once per batch
+    (crc32 of the vocabulary), the n-grams are combined from the word hashes with numpy. Texts with less than SHINGLE_WORDS words get MINHASH_PRIME.
+    """
+    texts = list(texts)
+    if len(texts) > MINHASH_BATCH_SIZE:
+        return np.concatenate([minhash_signatures(texts[i:i + MINHASH_BATCH_SIZE]) for i in range(0, len(texts), MINHASH_BATCH_SIZE)])
+
+    words = pd.Series(texts, dtype=object).astype(str).str.lower().str.split()
+    lengths = words.str.len().to_numpy()
+    signatures = np.full((len(lengths), MINHASH_PERMUTATIONS), MINHASH_PRIME, dtype=np.uint64)
+    if lengths.sum() < SHINGLE_WORDS:
+        return signatures
+
+    codes, vocabulary = pd.factorize(np.array(list(itertools.chain.from_iterable(words)), dtype=object))
+    word_hashes = np.array([zlib.crc32(word.encode("utf-8")) for word in vocabulary], dtype=np.uint64)[codes]
+    text_of_word = np.repeat(np.arange(len(lengths)), lengths)
+
+    # n-gram starting at each word that has SHINGLE_WORDS - 1 more words in the same text
+    starts = np.arange(len(word_hashes) - SHINGLE_WORDS + 1)
+    starts = starts[text_of_word[starts] == text_of_word[starts + SHINGLE_WORDS - 1]]
+    shingles = np.zeros(len(starts), dtype=np.uint64)
+    for k in range(SHINGLE_WORDS):
+        shingles = shingles * np.uint64(1000003) + word_hashes[starts + k]
+    shingles &= np.uint64(2**32 - 1)
+    rows = text_of_word[starts]
+
+    # fixed hash functions, the result does not change between runs
+    rng = np.random.default_rng(0)
+    a = rng.integers(1, 2**32, MINHASH_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, 2**32, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+    if len(rows):
+        # rows are ascending, the minimum of each text is taken over its block of n-grams
+        blocks = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        for k in range(MINHASH_PERMUTATIONS):
+            signatures[rows[blocks], k] = np.minimum.reduceat((shingles * a[k] + b[k]) % MINHASH_PRIME, blocks)
+    return signatures
+
+
+def near_duplicate_rows(authors:np.ndarray, texts, times:np.ndarray, window=REPOST_WINDOW, similarity=NEAR_DUPLICATE_SIMILARITY):
+    """
+    This function finds lightly edited reposts: rows of the same author posted at most window after a row with a similar text (minhash, see
+    minhash_signatures). Within each band the rows with the same author and band values are sorted by time and compared to their predecessor.
+    Args:
+        authors: author code of each row
+        texts: texts of the rows
+        times: datetime64 array
+    returns:
+        boolean array, True for near duplicates (the first row of a burst is kept)
+    """
+    signatures = minhash_signatures(texts)
+    has_words = signatures[:, 0] != MINHASH_PRIME
+    times = times.astype("datetime64[ns]").view(np.int64)
+    rows_per_band = MINHASH_PERMUTATIONS // MINHASH_BANDS
+
+    near = np.zeros(len(authors), dtype=bool)
+    for band in range(MINHASH_BANDS):
+        band_values = pd.DataFrame(signatures[:, band * rows_per_band:(band + 1) * rows_per_band]).assign(author=authors)
+        buckets = pd.factorize(pd.util.hash_pandas_object(band_values, index=False).to_numpy())[0]
+        order = np.lexsort((times, buckets))
+        previous, current = order[:-1], order[1:]
+        candidate = (buckets[previous] == buckets[current]) & has_words[current] & (times[current] - times[previous] <= window.value)
+        previous, current = previous[candidate], current[candidate]
+        equal = (signatures[previous] == signatures[current]).mean(axis=1)
+        near[current[equal >= similarity]] = True
+    return near
+
+
+def seen_duplicates(df:pd.DataFrame, seen:pd.DataFrame, window=REPOST_WINDOW):
+    """
+    This function applies the duplicate rules against rows that are already in the clean data (incremental mode, clean_csv):
+        - submissions with the same author and text as an earlier submission
+        - posts with the same author and text as a post in the clean data within window (before or after)
+    Args:
+        df: new rows
+        seen: key (see dedup_keys), category and date_time of the rows in the clean data
+    returns:
+        two boolean arrays (duplicated submissions, reposts)
+    """
+    keys = dedup_keys(df)
+    seen_submissions = seen.loc[seen["category"] == "submissions", "key"]
+    duplicated_submission = (keys.isin(seen_submissions) & (df["category"] == "submissions")).to_numpy()
 
-    # 86 cases from duplicated submissions dropped, 7023 comments with less than 10 words dropped (mommit)
-    final_df = pd.concat([submissions_df, comments_df], ignore_index=True) 
+    # nearest post in the clean data with the same key
+    new_posts = pd.DataFrame({
+        "key": keys.to_numpy(), "date_time": pd.to_datetime(df["date_time"]).to_numpy(dtype="datetime64[ns]"), "row": np.arange(len(df))
+    }).sort_values("date_time")
+    seen_posts = pd.DataFrame({
+        "key": seen["key"].astype(str).to_numpy(), "date_time": pd.to_datetime(seen["date_time"]).to_numpy(dtype="datetime64[ns]"), "seen": True
+    }).sort_values("date_time")
+    nearest = pd.merge_asof(new_posts, seen_posts, on="date_time", by="key", direction="nearest", tolerance=window)
+    repost = np.zeros(len(df), dtype=bool)
+    repost[nearest["row"].to_numpy()] = nearest["seen"].eq(True).to_numpy()
+
+    return duplicated_submission, repost
+
+
+def final_clean(df:pd.DataFrame, seen:pd.DataFrame=None, near_duplicates:bool=False, window=REPOST_WINDOW):
+    """
+    This function applies the last cleaning steps: short comments, html snippets, duplicated submissions, bot reposts and AutoModerator.
+    The duplicate rules group the rows by author and text (hash) and compare times only within a group.
+    Args:
+        df: data after clean_text_data
+        seen: rows that are already in the clean data, only for the incremental mode and clean_csv (see seen_duplicates)
+        near_duplicates: also drop lightly edited reposts (see near_duplicate_rows)
+        window: time window of the repost rules
+    returns:
+        final_df: clean data
+        report: dictionary with the number of dropped rows per rule (each row is counted for the first rule that drops it)
+            - short_comments: comments with less than 10 words
+            - duplicated_submissions: submissions with the same author and text as an earlier submission (the first one is kept)
+            - reposts: posts of the same author with the same text within window after the previous one
+            - seen_submissions, seen_reposts: the same rules against seen (only with seen)
+            - near_duplicates: only with near_duplicates
+            - automoderator: posts of AutoModerator
+    """
+    report = {}
+    submissions = (df["category"] == "submissions").to_numpy()
+    comments = (df["category"] == "comments").to_numpy()
+
+    # drop comments with less than 10 words: to be sure to grasp relevant info and not sth like "Awww thank you"
+    # (str.split in a list comprehension is faster than the regex based pandas string methods)
+    word_counts = np.array([len(body.split()) if isinstance(body, str) else 0 for body in df["body"].to_numpy()], dtype=np.int64)
+    short = comments & (word_counts < 10)
+    report["short_comments"] = int(short.sum())
+    final_df = pd.concat([df[submissions], df[comments & ~short]], ignore_index=True)
 
     # copy the body column (text column of comments)
     final_df["body_"]= final_df["body"]
@@ -227,67 +618,151 @@ def last_cleaning(df:pd.DataFrame):
 
     ## Replace html tags with empty strings
     # &amp = ampersand is depicted as "&"" on Reddit
-    final_df['whole_text'] = final_df['whole_text'].str.replace("\&amp;", "&") 
+    final_df['whole_text'] = final_df['whole_text'].str.replace("&amp;", "&", regex=False)
     # &gt; means that a sentence or part of another post/comment is referenced
-    final_df['whole_text'] = final_df['whole_text'].str.replace("\&gt;", "") 
+    final_df['whole_text'] = final_df['whole_text'].str.replace("&gt;", "", regex=False)
     # replace * with "" --> fat font
-    final_df['whole_text'] = final_df['whole_text'].str.replace("*", "")
+    final_df['whole_text'] = final_df['whole_text'].str.replace("*", "", regex=False)
 
-    ## drop duplicates where same person posts exact same thing in 5 min range - bots
-    # Convert post_time to datetime format
     final_df['date_time'] = pd.to_datetime(final_df['date_time'])
+    times = final_df['date_time'].to_numpy()
+    codes = group_codes(final_df, ["author", "whole_text"])
+    submissions = (final_df["category"] == "submissions").to_numpy()
+    keep = np.ones(len(final_df), dtype=bool)
 
-    # Sort dataframe by post_time
-    final_df.sort_values(by=["author", 'date_time'], inplace=True)
-
-    # Calculate time difference between posts
-    time_diff = final_df['date_time'].diff()
+    def drop(rule, rows):
+        report[rule] = int((keep & rows).sum())
+        keep[rows] = False
 
-    # Find rows where author and text are the same and posted within 5 minutes of each other
-    duplicates = final_df[(final_df.duplicated(subset=['author', 'whole_text'], keep=False)) & (time_diff <= pd.Timedelta('5 min'))]
-
-    # Drop the duplicate rows
-    final_df.drop(duplicates.index, inplace=True)
+    # clean dataframes with duplicated texts (sometimes the same things by the same authors are posted several times)
+    drop("duplicated_submissions", submissions & pd.Series(np.where(submissions, codes, -1)).duplicated().to_numpy())
+
+    # drop duplicates where same person posts exact same thing in 5 min range - bots
+    reposts = np.zeros(len(final_df), dtype=bool)
+    reposts[keep] = repost_rows(codes[keep], times[keep], window)
+    drop("reposts", reposts)
+
+    # drop duplicates of rows from earlier runs/chunks
+    if seen is not None:
+        seen_submissions, seen_reposts = seen_duplicates(final_df, seen, window)
+        drop("seen_submissions", seen_submissions)
+        drop("seen_reposts", seen_reposts)
+
+    # lightly edited reposts of the same author
+    if near_duplicates:
+        near = np.zeros(len(final_df), dtype=bool)
+        rows = np.flatnonzero(keep)
+        authors = pd.factorize(final_df["author"].astype(str).to_numpy()[rows])[0]
+        near[rows] = near_duplicate_rows(authors, final_df["whole_text"].to_numpy()[rows], times[rows], window)
+        drop("near_duplicates", near)
 
     # drop cases with author == AutoModerator
-    final_df=final_df[final_df["author"] != "AutoModerator"]
-
-    return final_df
-
+    drop("automoderator", (final_df["author"] == "AutoModerator").to_numpy())
 
-if __name__ == "__main__":
-    # read in csv files
-    mommit=pd.read_csv('mommit_subs_comments_final.csv', sep = ';').iloc[:,1:]
-    daddit=pd.read_csv('daddit_subs_comments_final.csv', sep = ';').iloc[:,1:]
+    return final_df[keep], report
 
-    # add information (hierarchy level and image)
-    mommit_add_info = add_info(mommit) 
-    daddit_add_info=add_info(daddit)
 
-    # data quality check
-    mommit_check= data_quality_check(mommit_add_info)
-    daddit_check=data_quality_check(daddit_add_info)
+def last_cleaning(df:pd.DataFrame, seen:pd.DataFrame=None, near_duplicates:bool=False):
+    """
+    This function applies the last cleaning steps (see final_clean)
+    Args:
+        df: data after clean_text_data
+        seen: rows that are already in the clean data, only for the incremental mode (see seen_duplicates)
+        near_duplicates: also drop lightly edited reposts
+    returns: clean df
+    """
+    final_df, report = final_clean(df, seen, near_duplicates)
 
-    # drop comments with [deleted] or [removed] in body
-    mommit_clean_comment=clean_comments(mommit_check)   
-    daddit_clean_comment=clean_comments(daddit_check)
+    return final_df
 
-    # merge title and selftext of submissions
-    mommit_final = title_selftext_merge(mommit_clean_comment)
-    daddit_final = title_selftext_merge(daddit_clean_comment)
 
-    # clean submissions from languages or [deleted] or [removed] snippets
-    mommit_final_2= clean_text_data(mommit_final)
-    daddit_final_2=clean_text_data(daddit_final)
+def clean_csv(csv:str, clean_csv_path:str, chunksize=None, cache_path="language_cache.json", near_duplicates=False, run:Run=None,
+              cube:AggregateCube=None):
+    """
+    This function runs all cleaning steps (add_info, quality_clean, title_selftext_merge, clean_text_data, last_cleaning) on a csv file of
+    read_in_txt.py and writes <subreddit>_clean.csv. With chunksize only one chunk of threads is in memory at a time:
+        - a thread is never split between two chunks (see thread_chunks)
+        - the depth of the comments of earlier chunks is passed to add_info, replies to them get the right depth
+        - the duplicate rules are applied against the rows of the earlier chunks (see seen_duplicates)
+        - the rows are sorted by permalink_short and date_time within each chunk
+    Args:
+        csv: e.g. "mommit_subs_comments_final.csv"
+        clean_csv_path: e.g. "mommit_clean.csv"
+        chunksize: rows per chunk, None to clean the whole file at once
+        cache_path: language cache (see detect_languages)
+        near_duplicates: also drop lightly edited reposts (see final_clean)
+        run: instrumentation.Run that records time and rows in/out of each step, None for no output
+        cube: aggregate_cube.AggregateCube the clean rows are added to (counts per subreddit, category and day), None for no cube
+    returns:
+        report of quality_clean and final_clean (counts summed over the chunks)
+    """
+    if run is None:
+        run = Run(os.path.basename(csv), logger=None)
+    if chunksize is None:
+        with run.stage("load_csv", bytes_in=os.path.getsize(csv)) as record:
+            chunks = [load_csv(csv)]
+            record["rows_out"] = len(chunks[0])
+    else:
+        chunks = thread_chunks(load_csv(csv, chunksize=chunksize))
+    if os.path.exists(clean_csv_path):
+        os.remove(clean_csv_path)
+
+    report = {}
+    known_depth = None
+    seen = None
+    for chunk in chunks:
+        chunk = run.step("add_info", add_info, chunk.reset_index(drop=True), known_depth)
+        clean_chunk, chunk_report = run.step("quality_clean", quality_clean, chunk)
+        clean_chunk = run.step("title_selftext_merge", title_selftext_merge, clean_chunk, cache_path)
+        clean_chunk = run.step("clean_text_data", clean_text_data, clean_chunk)
+        clean_chunk, final_report = run.step("last_cleaning", final_clean, clean_chunk, seen, near_duplicates)
+        chunk_report.update(final_report)
+        if cube is not None:
+            run.step("aggregate_cube", cube.add, clean_chunk)
+        with run.stage("to_csv", rows_in=len(clean_chunk)):
+            clean_chunk = clean_chunk.sort_values(["permalink_short", "date_time"])
+            clean_chunk.to_csv(clean_csv_path, sep=";", mode="a", header=not os.path.exists(clean_csv_path))
+
+        for key, count in chunk_report.items():
+            report[key] = report.get(key, 0) + count
+        if chunksize is None:
+            break
+
+        # state for the next chunks: depth of the comments (only depth > 0 is needed) and the duplicate keys of the clean rows
+        comments = (chunk["category"] == "comments").to_numpy() & (chunk["test_hier_complete"] > 0).to_numpy()
+        chunk_depth = pd.Series(chunk.loc[comments, "test_hier_complete"].to_numpy(), index=chunk.loc[comments, "id"].to_numpy())
+        known_depth = chunk_depth if known_depth is None else pd.concat([known_depth, chunk_depth])
+        known_depth = known_depth[~known_depth.index.duplicated(keep="last")]
+        chunk_seen = pd.DataFrame({"key": dedup_keys(clean_chunk), "category": clean_chunk["category"].astype(str), "date_time": clean_chunk["date_time"]})
+        seen = chunk_seen if seen is None else pd.concat([seen, chunk_seen], ignore_index=True)
+
+    return report
 
-    # final steps for clean dataframe
-    mommit_final_final= last_cleaning(mommit_final_2)
-    daddit_final_final= last_cleaning(daddit_final_2)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean the csv files of read_in_txt.py")
+    parser.add_argument("--chunksize", type=int, default=None, help=f"rows per chunk (e.g. {CHUNK_ROWS}) to keep only one chunk in memory, default: whole file")
+    parser.add_argument("--near-duplicates", action="store_true", help="also drop lightly edited reposts of the same author (minhash)")
+    parser.add_argument("--trace", default=None, help="json file for the stages of the run (time, rows in/out, memory) and the row reports")
+    parser.add_argument("--profile", default=None, help="file for the cProfile stats of the run")
+    parser.add_argument("--keywords", default=KEYWORDS_FILE, help="json file {category: [keywords]} for the keyword hit counts of the aggregate cube")
+    args = parser.parse_args()
+
+    # read in csv files, clean and preprocess them --> input data for BERTopic
+    # steps: add information (hierarchy level and image), data quality check and drop comments with [deleted] or [removed] in body,
+    # merge title and selftext of submissions, clean submissions from languages or [deleted] or [removed] snippets, final steps,
     # sort submission with respective comments by time
-    mommit_final_final=mommit_final_final.sort_values(["permalink_short", "date_time"])
-    daddit_final_final=daddit_final_final.sort_values(["permalink_short", "date_time"])
-
-    # final clean and preprocessed data --> input data for BERTopic
-    mommit_final_final.to_csv("mommit_clean.csv", sep = ';') 
-    daddit_final_final.to_csv("daddit_clean.csv", sep=";")
+    with Run("preprocessing_BERTopic", args.trace, args.profile) as run:
+        keywords = load_keywords(args.keywords)
+        mommit_cube, daddit_cube = AggregateCube(keywords), AggregateCube(keywords)
+        mommit_report = clean_csv("mommit_subs_comments_final.csv", "mommit_clean.csv", args.chunksize, near_duplicates=args.near_duplicates, run=run,
+                                  cube=mommit_cube)
+        daddit_report = clean_csv("daddit_subs_comments_final.csv", "daddit_clean.csv", args.chunksize, near_duplicates=args.near_duplicates, run=run,
+                                  cube=daddit_cube)
+        # counts per subreddit, category and day (with keyword hits per keyword category) for the trend plots (see aggregate_cube.py)
+        mommit_cube.save(os.path.join(CUBE_FOLDER, "mommit"))
+        daddit_cube.save(os.path.join(CUBE_FOLDER, "daddit"))
+        print("mommit:", mommit_report)
+        print("daddit:", daddit_report)
+        run.note("mommit", mommit_report)
+        run.note("daddit", daddit_report)
@@ -1,25 +1,34 @@
 import pandas as pd
 import json
 import os
+import argparse
+
+from instrumentation import Run
 
 """
 - this script builds a csv file for mommit and daddit data
 - first 4 dataframes are build from the text files. Mommit comments & submissions and daddit comments & submissions
 - match mommit submissions with its comments & daddit submissions with its comments based on parts of the hyperlink
     - order of comments only in timely manner not real hierarchy considered. In most cases that is the real hierarchy anyways
+- if data_dump_read.py wrote parquet files (--parquet "filtered parquet"), they are read instead of the text files
 """
 
+# relevant columns of submissions and comments
+SUBMISSION_COLUMNS = ["title", "selftext", "author", "date_time","permalink",  "id", "num_comments", "subreddit", "url", "score", "author_flair_text", "edited", "created_utc"] # added score
+COMMENT_COLUMNS = ["body", "author","date_time", "parent_id", "link_id", "is_submitter", "permalink", "id", "subreddit", "score", "author_flair_richtext", "author_flair_template_id", "author_flair_text", "edited", "created_utc"] # added id and score
+
 
-def build_df(txt_category):
+def build_df(txt_category, folder_path=None):
     """
     creates a dataframe of different txt file that are already grouped into mommit/daddit & submission/ comments
     Args:
         txt_categroy: for each category there is a list [] of relevant file names
+        folder_path: folder of the txt files, None for the current working directory
     """
     data_mod=[]
     for txt in txt_category:
-        file_path_modular= os.path.join(cwd, txt)
-        with open(file_path_modular, "r") as file:
+        file_path_modular= os.path.join(folder_path if folder_path is not None else cwd, txt)
+        with open(file_path_modular, "r", encoding="utf-8") as file:
             data_mod.extend([json.loads(line) for line in file])
     df_mod=pd.DataFrame(data_mod)
     
@@ -28,14 +37,66 @@ def build_df(txt_category):
 
     return df_mod
 
+def subreddit_partitions(folder, subreddit:str, category:str):
+    """
+    values of the subreddit partition folders of a category that match the subreddit in any case (subreddit=mommit, also subreddit=Mommit of older runs)
+    """
+    category_folder=os.path.join(folder, f"category={category}")
+    if not os.path.isdir(category_folder):
+        return []
+    return [name.split("=", 1)[1] for name in os.listdir(category_folder) if name.lower() == f"subreddit={subreddit.lower()}"]
+
+def decode_edited(value):
+    """
+    edited as in the dump (False, True or the time of the edit), the parquet files store 0.0, 1.0 or the time
+    """
+    if value == 0:
+        return False
+    if value == 1:
+        return True
+    return int(value) if float(value).is_integer() else value
+
+def build_df_parquet(folder, subreddit:str, category:str, months=None):
+    """
+    creates a dataframe from the parquet partitions (category/subreddit/month) written by data_dump_read.py.
+    Only the relevant columns are read and only the partitions of the subreddit, category and months.
+    The result has the same values as build_df: the subreddit is taken from the permalink (the partitions are lower case), json strings
+    (author_flair_richtext) and edited are decoded
+    Args:
+        folder: folder with the parquet partitions
+        subreddit: e.g. "Mommit" (any case)
+        category: "submissions" or "comments"
+        months: list of months like "2019-12", None for all months
+    """
+    columns= SUBMISSION_COLUMNS if category == "submissions" else COMMENT_COLUMNS
+    partitions=subreddit_partitions(folder, subreddit, category)
+    if not partitions:
+        return pd.DataFrame(columns=columns)
+    filters=[("subreddit", "in", partitions)]
+    if months is not None:
+        filters.append(("month", "in", list(months)))
+    df_mod=pd.read_parquet(os.path.join(folder, f"category={category}"), columns=[col for col in columns if col != "date_time"], filters=filters)
+
+    # subreddit as in the dump (e.g. Mommit): /r/Mommit/comments/...
+    df_mod["subreddit"]=df_mod["permalink"].str.split("/").str[2]
+    if "author_flair_richtext" in df_mod:
+        df_mod["author_flair_richtext"]=df_mod["author_flair_richtext"].map(json.loads, na_action="ignore")
+    df_mod["edited"]=df_mod["edited"].astype(object).map(decode_edited, na_action="ignore")
+
+    # add human readable time stamp
+    df_mod["date_time"]=pd.to_datetime(df_mod['created_utc'], unit='s')
+
+    return df_mod
+
 def rel_submissions(df:pd.DataFrame()):
     """
     reduces the submissions dataframes to relevant columns and adds a category column
     Args:
         df: df to reduce to only keep relevant columns for submissions df
     """
-    df_submissions= df[["title", "selftext", "author", "date_time","permalink",  "id", "num_comments", "subreddit", "url", "score", "author_flair_text", "edited", "created_utc"]] # added score
+    df_submissions= df[SUBMISSION_COLUMNS]
     df_submissions["category"]="submissions" # add a column with category = submissions
+    df_submissions["permalink_short"]=df_submissions["permalink"] # groups a submission with its comments
     return df_submissions
 
 def rel_comments(df:pd.DataFrame()):
@@ -44,70 +105,114 @@ def rel_comments(df:pd.DataFrame()):
     Args:
         df: df to reduce to only keep relevant columns for comments df
     """
-    df_comments= df[["body", "author","date_time", "parent_id", "link_id", "is_submitter", "permalink", "id", "subreddit", "score", "author_flair_richtext", "author_flair_template_id", "author_flair_text", "edited", "created_utc"]] # added id and score
+    df_comments= df[COMMENT_COLUMNS]
     df_comments["category"]="comments" # add a column with category comments
+    df_comments["permalink_short"]=thread_permalink(df_comments["permalink"]) # permalink of the submission
     return df_comments
 
 
+def thread_permalink(permalink:pd.Series):
+    """
+    cuts the last part (the comment id) from comment permalinks: /r/Mommit/comments/abc/title/def/ -> /r/Mommit/comments/abc/title/
+    this is the permalink of the submission the comment belongs to (permalink_short). Like splitting at "/", removing the second last part
+    and all empty parts and joining again, but for the whole column at once
+    Args:
+        permalink: permalinks of comments
+    """
+    short= permalink.str.replace(r"[^/]*/([^/]*)$", r"/\1", regex=True).str.replace(r"/+", "/", regex=True).str.strip("/")
+    return "/" + short + "/"
+
+
 def submissions_comments_match(df_submissions:pd.DataFrame(), df_comments:pd.DataFrame(), lst_permalink):
     """
     This function combines submissions with comments for mommit and daddit into one dataframe. Permalink is what can bring the submission together
-    with its respective comments. An empty df is initalized. A list with a permalink for each submission is needed. The function loops over the list
-    and filters the df_comments for the respective permalink (startswith b/c for each comment the permalink has an indidual ending. But with 
-    startswith i can grasp the relevant comments for the respective submission). The result is stored in comments. The submissions are also filtered for 
-    the elements in the list. Comments and submissions are concated for each iteration and sorted by date_time. In the end this concated df is concated
-    with the empty dataframe which succesivly with each iteration of the loop grows.
+    with its respective comments. Each comment permalink starts with the permalink of its submission and has an indidual ending (the comment id).
+    The ending is cut once for all comments (permalink_short, added in rel_comments), then comments and submissions are joined on this thread permalink in the order of lst_permalink.
+    Within each thread comments and submission are sorted by date_time. The result has the same rows, order and index (position within the thread
+    before sorting, comments first) as matching the threads one by one.
     Args:
         df_submissions: dataframe with submissions 
         df_comments: dataframe with comments
         lst_permalink: list with a permalink for each submission
     """
-    pairs_df=pd.DataFrame() 
-    for link in lst_permalink:
-         comments= df_comments[df_comments["permalink"].str.startswith(link)]
-         submissons= df_submissions[df_submissions["permalink"]==link]
-         concat_subs_com= pd.concat([comments, submissons], axis=0, ignore_index=True).sort_values(by="date_time")
-         pairs_df=pd.concat([pairs_df, concat_subs_com])
+    threads=pd.DataFrame({"_thread_link": lst_permalink, "_thread": range(len(lst_permalink))})
+
+    # thread key and original order for comments and submissions (comments before submissions)
+    comment_links=df_comments["permalink_short"] if "permalink_short" in df_comments else thread_permalink(df_comments["permalink"])
+    comments=df_comments.assign(_thread_link=comment_links, _order=range(len(df_comments)))
+    submissions=df_submissions.assign(_thread_link=df_submissions["permalink"], _order=range(len(df_comments), len(df_comments)+len(df_submissions)))
+
+    pairs_df=pd.concat([comments, submissions], axis=0, ignore_index=True)
+    pairs_df=threads.merge(pairs_df, on="_thread_link", how="inner")
+
+    # index = position in the thread before sorting, then sort each thread by date_time (ties keep that position)
+    pairs_df=pairs_df.sort_values(by=["_thread", "_order"], kind="mergesort")
+    pairs_df.index=pairs_df.groupby("_thread").cumcount().to_numpy()
+    pairs_df=pairs_df.sort_values(by=["_thread", "date_time", "_order"], kind="mergesort")
 
-    return pairs_df
+    return pairs_df.drop(columns=["_thread_link", "_thread", "_order"])
 
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match the submissions and comments of r/Mommit and r/daddit")
+    parser.add_argument("--trace", default=None, help="json file for the stages of the run (time, rows, memory)")
+    parser.add_argument("--profile", default=None, help="file for the cProfile stats of the run")
+    args = parser.parse_args()
+
     # get current working directory
     # text files are in "filtered text files"
     cwd=os.getcwd()
     print(cwd)
-    folder_name="filtered text files"
-    folder_path= os.path.join(cwd, folder_name)
-    files=os.listdir(folder_path)
-
-    # get list of relevant text files
-    daddit_submissions=[file for file in files if file.startswith('daddit_submissions')]
-    daddit_comments=[file for file in files if file.startswith('daddit_comments')]
-    mommit_submissions=[file for file in files if file.startswith('mommit_submissions')]
-    mommit_comments=[file for file in files if file.startswith('mommit_comments')]
-
-    # apply build_df function
-    df_submissions_daddit=build_df(daddit_submissions)
-    df_submissions_mommit=build_df(mommit_submissions)
-    df_comments_daddit=build_df(daddit_comments)
-    df_comments_mommit=build_df(mommit_comments)
-
-    # reduce dfs to relevant columns
-    df_submissions_daddit_short=rel_submissions(df_submissions_daddit)
-    df_submissions_mommit_short=rel_submissions(df_submissions_mommit)
-    df_comments_daddit_short=rel_comments(df_comments_daddit)
-    df_comments_mommit_short=rel_comments(df_comments_mommit)
-
-    # list with permalinks to submissions
-    lst_permalinks_mommit= df_submissions_mommit_short["permalink"].values.tolist()
-    lst_permalinks_daddit= df_submissions_daddit_short["permalink"].values.tolist()
-    
-    # based on permalink match submissions with respective comments
-    subs_comments_mommit=submissions_comments_match(df_submissions_mommit_short, df_comments_mommit_short,lst_permalinks_mommit)
-    subs_comments_daddit= submissions_comments_match(df_submissions_daddit_short, df_comments_daddit_short, lst_permalinks_daddit)
-
-    # final csv files
-    subs_comments_mommit.to_csv("mommit_subs_comments_final.csv", sep = ';') 
-    subs_comments_daddit.to_csv("daddit_subs_comments_final.csv", sep=";")    
\ No newline at end of file
+    parquet_path= os.path.join(cwd, "filtered parquet")
+
+    with Run("read_in_txt", args.trace, args.profile) as run:
+        if os.path.isdir(parquet_path):
+            # read only the relevant columns from the parquet files
+            with run.stage("build_df_parquet") as record:
+                df_submissions_daddit=build_df_parquet(parquet_path, "daddit", "submissions")
+                df_submissions_mommit=build_df_parquet(parquet_path, "Mommit", "submissions")
+                df_comments_daddit=build_df_parquet(parquet_path, "daddit", "comments")
+                df_comments_mommit=build_df_parquet(parquet_path, "Mommit", "comments")
+                record["rows_out"] = len(df_submissions_daddit) + len(df_submissions_mommit) + len(df_comments_daddit) + len(df_comments_mommit)
+        else:
+            folder_name="filtered text files"
+            folder_path= os.path.join(cwd, folder_name)
+            files=os.listdir(folder_path)
+
+            # get list of relevant text files
+            daddit_submissions=[file for file in files if file.startswith('daddit_submissions')]
+            daddit_comments=[file for file in files if file.startswith('daddit_comments')]
+            mommit_submissions=[file for file in files if file.startswith('mommit_submissions')]
+            mommit_comments=[file for file in files if file.startswith('mommit_comments')]
+
+            # apply build_df function
+            with run.stage("build_df", bytes_in=sum(os.path.getsize(os.path.join(folder_path, file)) for file in files if file.endswith(".txt"))) as record:
+                df_submissions_daddit=build_df(daddit_submissions, folder_path)
+                df_submissions_mommit=build_df(mommit_submissions, folder_path)
+                df_comments_daddit=build_df(daddit_comments, folder_path)
+                df_comments_mommit=build_df(mommit_comments, folder_path)
+                record["rows_out"] = len(df_submissions_daddit) + len(df_submissions_mommit) + len(df_comments_daddit) + len(df_comments_mommit)
+
+        # reduce dfs to relevant columns
+        df_submissions_daddit_short=rel_submissions(df_submissions_daddit)
+        df_submissions_mommit_short=rel_submissions(df_submissions_mommit)
+        df_comments_daddit_short=rel_comments(df_comments_daddit)
+        df_comments_mommit_short=rel_comments(df_comments_mommit)
+
+        # list with permalinks to submissions
+        lst_permalinks_mommit= df_submissions_mommit_short["permalink"].values.tolist()
+        lst_permalinks_daddit= df_submissions_daddit_short["permalink"].values.tolist()
+        
+        # based on permalink match submissions with respective comments (rows in: submissions and comments, rows out: matched rows)
+        with run.stage("submissions_comments_match", rows_in=len(df_submissions_mommit_short) + len(df_comments_mommit_short)) as record:
+            subs_comments_mommit=submissions_comments_match(df_submissions_mommit_short, df_comments_mommit_short,lst_permalinks_mommit)
+            record["rows_out"] = len(subs_comments_mommit)
+        with run.stage("submissions_comments_match", rows_in=len(df_submissions_daddit_short) + len(df_comments_daddit_short)) as record:
+            subs_comments_daddit= submissions_comments_match(df_submissions_daddit_short, df_comments_daddit_short, lst_permalinks_daddit)
+            record["rows_out"] = len(subs_comments_daddit)
+
+        # final csv files
+        with run.stage("to_csv", rows_in=len(subs_comments_mommit) + len(subs_comments_daddit)):
+            subs_comments_mommit.to_csv("mommit_subs_comments_final.csv", sep = ';') 
+            subs_comments_daddit.to_csv("daddit_subs_comments_final.csv", sep=";")
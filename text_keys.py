@@ -0,0 +1,13 @@
+import hashlib
+
+"""
+- keys of texts shared by the language cache of preprocessing_BERTopic.py and the embedding cache of embedding_cache.py
+- only needs hashlib, so embedding_cache.py does not import the cleaning (langdetect, read_in_txt, aggregate_cube) to compute its keys
+"""
+
+
+def text_hash(text:str):
+    """
+    sha1 of the utf-8 text, key of a text in the language cache and the embedding cache
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()